@@ -1,9 +1,13 @@
-from dataclasses import fields
 import streamlit as st
 import re
+import time
+import json
 import altair as alt
-import snscrape.modules.twitter as sntwitter
 import pandas as pd
+import instrument
+import pipeline
+from pipeline import (PartialScrapeError, loadDataset, twitterDataframeStream, addSentimentColumns,
+                      memoryReport, frameFingerprint, CHART_KINDS, BOXPLOT_KINDS, ROLLING_KINDS)
 
 ########################### Streamlit configs ###########################
 
@@ -45,50 +49,53 @@ st.set_page_config(page_title='Twitter dashboard', page_icon='https://cdn-icons-
 
 ########################### Data Pipeline ###########################
 
-def twitterProfileScrape(twitter_url, n_tweets=100):
-    # Creating list to append tweet data to
-    tweets_list = []
-    user = twitter_url.replace('https://twitter.com/', '')
-    # Using TwitterSearchScraper to scrape data and append tweets to list
-    for i,tweet in enumerate(sntwitter.TwitterSearchScraper(f'from:{user}').get_items()):
-        if i > n_tweets:
-            break
-        
-        else:
-            
-            tweets_list.append([tweet.user.username, tweet.user.displayname, tweet.user.renderedDescription,
-                             tweet.user.followersCount,tweet.user.friendsCount, tweet.date, tweet.id, 
-                             tweet.rawContent, tweet.likeCount, tweet.retweetCount, tweet.replyCount])
-
-    # Creating a dataframe from the tweets list above 
-    tweets_df = pd.DataFrame(tweets_list, columns=['Username', 'Displayname', 'Description', 'Follower Count', 
-                                                    'Following Count', 'Datetime', 'Tweet Id', 'Text', 'Likes',
-                                                     'Retweets', 'Replies'])
-    
-    tweets_df['like_ratio'] = (tweets_df['Likes'] / tweets_df['Follower Count']) * 100
-    tweets_df['RT_ratio'] = (tweets_df['Retweets'] / tweets_df['Follower Count']) * 100
-    tweets_df['reply_ratio'] = (tweets_df['Replies'] / tweets_df['Follower Count']) * 100
-    tweets_df['engagement_ratio'] = ((tweets_df['Likes'] + tweets_df['Retweets'] + tweets_df['Replies']) / tweets_df['Follower Count']) * 100
-    tweets_df['day'] = tweets_df.Datetime.dt.day
-    tweets_df['week'] = tweets_df.Datetime.dt.isocalendar().week
-    tweets_df['month'] = tweets_df.Datetime.dt.month
-    tweets_df['date'] = tweets_df.Datetime.dt.date
-
-    return tweets_df
-
-@st.experimental_memo(show_spinner=False)
-def twitterDataframeConcat(url_list, n_tweets):
-    dataframe = pd.DataFrame(columns=['Username', 'Displayname', 'Description', 'Follower Count', 
-                                      'Following Count', 'Datetime', 'Tweet Id', 'Text', 'Likes',
-                                      'Retweets', 'Replies'])
-    for twitter_url in url_list:
-        dataframe = pd.concat([dataframe, twitterProfileScrape(twitter_url, n_tweets)])
-    
-    return dataframe
+# Scraping, frame building and sentiment live in pipeline.py, shared with
+# the precompute command line; the dashboard starts from the dataset it
+# precomputed when there is one
+
+@st.experimental_memo(show_spinner=False, max_entries=1)
+def precomputedDataset(generated_at):
+    return pipeline.readPrecomputed()
+
+@st.experimental_memo(show_spinner=False, max_entries=4)
+def memoryTable(_df, _profiles, fingerprint):
+    return memoryReport(_df, _profiles)
 
 ########################### Data viz ###########################
 
-def make_chart(df, kind, period='week'):
+# Vega-Lite type of each period column's x axis; week and month hold numbers
+PERIOD_TYPES = {'date': 'T', 'week': 'O', 'month': 'O'}
+PERIOD_LABELS = {'date': 'Dia', 'week': 'Semana', 'month': 'Mês'}
+
+@st.experimental_memo(show_spinner=False, max_entries=64)
+def periodTable(_df, fingerprint, period):
+    # Read back from the precomputed dataset when it holds these tweets;
+    # by day, the rolling metrics come along
+    table = pipeline.precomputedTable(f'period-{period}', fingerprint)
+    if table is None:
+        table = pipeline.periodTable(_df, period)
+    if period == 'date':
+        rolling = pipeline.precomputedTable('rolling', fingerprint)
+        if rolling is None:
+            rolling = pipeline.rollingTable(_df)
+        table = table.astype({'Username': str}).merge(rolling.astype({'Username': str}), how='outer',
+                                                       on=['Username', 'date'])
+    return table
+
+def chartData(df, period):
+    # The only dataset of the analytics page: the period table, pruned to
+    # the columns the charts reference
+    return periodTable(df, frameFingerprint(df), period)
+
+@st.experimental_memo(show_spinner=False, max_entries=64)
+def boxplotTable(_df, fingerprint):
+    # Same as periodTable, for the boxplots
+    table = pipeline.precomputedTable('boxplot', fingerprint)
+    return pipeline.boxplotTable(_df) if table is None else table
+
+def make_chart(data, kind, period='week'):
+    # data is a period table, or alt.Undefined to draw from the dataset of
+    # the chart this one is concatenated into
     hover = alt.selection_single(
         fields=[f'{period}'],
         nearest=True,
@@ -97,11 +104,11 @@ def make_chart(df, kind, period='week'):
     )
 
     lines = (
-        alt.Chart(df, title=f'{kind}')
+        alt.Chart(data, title=f'{kind}')
         .mark_line()
         .encode(
-            x=f'{period}:T',
-            y=alt.Y(f'sum({kind}):Q', title=f'{kind}'),
+            x=f'{period}:{PERIOD_TYPES.get(period, "T")}',
+            y=alt.Y(f'{kind}:Q', title=f'{kind}'),
             color='Username:N'
         )
     )
@@ -109,7 +116,7 @@ def make_chart(df, kind, period='week'):
     points = lines.transform_filter(hover).mark_circle(size=65)
 
     tooltips = (
-        alt.Chart(df)
+        lines
         .mark_rule()
         .encode(
             x=f'{period}',
@@ -122,47 +129,197 @@ def make_chart(df, kind, period='week'):
         )
         .add_selection(hover)
     )
-    return (lines + points + tooltips).interactive()
+    return (lines + points + tooltips).properties(width=600).interactive()
+
+def make_analytics_chart(df, period='week'):
+    data = chartData(df, period)
+    kinds = [kind for kind in CHART_KINDS + ROLLING_KINDS if kind in data.columns]
+    return alt.vconcat(*[make_chart(alt.Undefined, kind, period) for kind in kinds], data=data)
 
-def make_boxplot(df, kind):
-    chart = (
-        alt.Chart(df, title=f'{kind}')
-        .mark_boxplot(size=50, extent=2, outliers=False)
+def make_boxplot(data, kind):
+    # data is a boxplotTable, or alt.Undefined to draw from the dataset of
+    # the chart this one is concatenated into
+    base = (
+        alt.Chart(data, title=f'{kind}')
+        .transform_filter(alt.datum.kind == kind)
         .encode(
             x='Username:N',
-            y=alt.Y(f'{kind}:Q', scale=alt.Scale(zero=False)),
             color=alt.Color('Username')
         )
-        .properties(width=600)
     )
-    return chart
+    whiskers = base.mark_rule().encode(
+        y=alt.Y('lower:Q', title=f'{kind}', scale=alt.Scale(zero=False)),
+        y2='upper:Q'
+    )
+    boxes = base.mark_bar(size=50).encode(
+        y='q1:Q',
+        y2='q3:Q',
+        tooltip=['Username', 'count', 'lower', 'q1', 'median', 'q3', 'upper']
+    )
+    medians = base.mark_tick(color='white', size=50).encode(y='median:Q')
+    return (whiskers + boxes + medians).properties(width=600)
+
+def make_boxplots(df, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = frameFingerprint(df)
+    data = boxplotTable(df, fingerprint)
+    return alt.vconcat(*[make_boxplot(alt.Undefined, kind) for kind in BOXPLOT_KINDS], data=data)
+
+@st.experimental_singleton(show_spinner=False, max_entries=32)
+def chartSpec(_df, fingerprint, kind, period=None):
+    # Vega-Lite spec of a view and its size in bytes, built once per dataset
+    # and period. A singleton rather than a memo, so hits hand back the same
+    # dict instead of unpickling a copy; st.vega_lite_chart copies it before
+    # changing anything, so it is never mutated
+    instrument.count('chart_spec.miss')
+    with instrument.span('chart.spec', kind=kind, period=period) as attrs:
+        if kind == 'analytics':
+            chart = make_analytics_chart(_df, period)
+        else:
+            chart = make_boxplots(_df, fingerprint)
+        spec = chart.to_dict()
+        attrs['bytes'] = len(json.dumps(spec))
+    return spec, attrs['bytes']
 
 ########################### Event Handlers ###########################
+def storeLoadedTweets(df, profiles):
+    st.session_state['df'], st.session_state['profiles'] = df, profiles
+    st.session_state['fingerprint'] = frameFingerprint(df)
+
 def handle_load_tweets(candidates, n_tweets):
-    
+    progress = st.progress(0)
+    status = st.empty()
+    done = []
+
+    def on_progress(twitter_url, n_scraped, error):
+        done.append(twitter_url)
+        progress.progress(len(done) / len(candidates))
+        user = re.sub('https://twitter.com/', '', twitter_url)
+        if error is None:
+            status.write(f'{user}: {n_scraped} tweets ({len(done)}/{len(candidates)})')
+        else:
+            status.write(f'{user}: falhou ({len(done)}/{len(candidates)})')
+
     with st.spinner(f'Carregando os últimos {n_tweets} tweets...'):
-        df = twitterDataframeConcat(candidates, n_tweets)
-        return df
+        try:
+            df, profiles = loadDataset(candidates, n_tweets, on_progress=on_progress)
+        except PartialScrapeError as partial:
+            for twitter_url, error in partial.errors.items():
+                st.warning(f'Não foi possível carregar {twitter_url}: {error}')
+            df, profiles = partial.dataframe, partial.profiles
+    progress.empty()
+    status.empty()
+    return df, profiles
+
+def handle_stream_tweets(candidates, n_tweets):
+    cancel_slot = st.sidebar.empty()
+    cancel_slot.button('Cancelar carregamento')
+    labels = {}
+    bars = {}
+    for twitter_url in candidates:
+        labels[twitter_url] = st.empty()
+        bars[twitter_url] = st.progress(0)
+    metrics = st.empty()
+    chart = st.empty()
+    latest = {}
+
+    def on_refresh(df, profiles, scraped, finished):
+        df = addSentimentColumns(df)
+        latest['tweets'] = df, profiles
+        for twitter_url in candidates:
+            user = re.sub('https://twitter.com/', '', twitter_url)
+            done = twitter_url in finished
+            labels[twitter_url].caption(f'{user}: {scraped[twitter_url]} tweets' + (' (concluído)' if done else ''))
+            bars[twitter_url].progress(1.0 if done else min(scraped[twitter_url] / (n_tweets + 1), 1.0))
+        with metrics.container():
+            users = df.groupby('Username', observed=True)
+            for column, (username, tweets) in zip(st.columns(max(len(users), 1)), users):
+                column.metric(username, f'{len(tweets)} tweets')
+                column.caption(f'sentimento médio {tweets.compound.mean():+.3f}')
+        chart.altair_chart(make_analytics_chart(df, st.session_state.get('period', 'date')),
+                           use_container_width=True)
 
-def handle_show_analytics(df, period):
+    try:
+        df, profiles = twitterDataframeStream(candidates, n_tweets, on_refresh)
+    except PartialScrapeError as partial:
+        for twitter_url, error in partial.errors.items():
+            st.warning(f'Não foi possível carregar {twitter_url}: {error}')
+        df, profiles = partial.dataframe, partial.profiles
+    except BaseException:
+        # Clicking cancel (or any widget) stops this run and the scrapes
+        # with it; what was loaded so far stays on screen
+        if 'tweets' in latest:
+            storeLoadedTweets(*latest['tweets'])
+        raise
+
+    for placeholder in [cancel_slot, metrics, chart, *labels.values(), *bars.values()]:
+        placeholder.empty()
+    return addSentimentColumns(df), profiles
+
+def handle_show_analytics(df, period, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = frameFingerprint(df)
     st.latex(r'''engagement\underline{\hspace{.05in}}ratio = \frac{(Likes + Retweets + Replies)}{Followers}''')
-    st.altair_chart(make_chart(df=df, kind='engagement_ratio', period=period).interactive(), use_container_width=True)
     st.latex(r'''like\underline{\hspace{.05in}}ratio = \frac{Likes}{Followers}''')
-    st.altair_chart(make_chart(df=df, kind='like_ratio', period=period).interactive(), use_container_width=True)
     st.latex(r'''RT\underline{\hspace{.05in}}ratio = \frac{Retweets}{Followers}''')
-    st.altair_chart(make_chart(df=df, kind='RT_ratio', period=period).interactive(), use_container_width=True)
     st.latex(r'''Reply\underline{\hspace{.05in}}ratio = \frac{Replies}{Followers}''')
-    st.altair_chart(make_chart(df=df, kind='reply_ratio', period=period).interactive(), use_container_width=True)
-    st.altair_chart(make_chart(df=df, kind='Likes', period=period).interactive(), use_container_width=True)
-    st.altair_chart(make_chart(df=df, kind='Retweets', period=period).interactive(), use_container_width=True)
-    st.altair_chart(make_chart(df=df, kind='Replies', period=period).interactive(), use_container_width=True)
-
-def handle_show_boxplot(df):
-    st.altair_chart(make_boxplot(df=df, kind='Likes'), use_container_width=True)
-    st.altair_chart(make_boxplot(df=df, kind='Retweets'), use_container_width=True)
-    st.altair_chart(make_boxplot(df=df, kind='Replies'), use_container_width=True)
+    show_chart(df, fingerprint, 'analytics', period)
+
+def handle_show_boxplot(df, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = frameFingerprint(df)
+    show_chart(df, fingerprint, 'boxplot')
+
+# Days before a profile's newest tweet searched by the terms view, or None for all
+TERM_WINDOWS = {'Última semana': 7, 'Último mês': 30, 'Tudo': None}
+
+def handle_show_terms(df):
+    # Drill-down into the lexicon words behind a profile's sentiment, read
+    # from the index filled in while the tweets were scored
+    user = st.selectbox('Perfil', sorted(df['Username'].astype(str).unique()))
+    window = st.radio('Intervalo', list(TERM_WINDOWS), horizontal=True)
+    # The window ends just after the profile's newest tweet in df, as end is exclusive
+    latest = df.loc[df['Username'] == user, 'Datetime'].max()
+    start, end = None, latest + pd.Timedelta(seconds=1)
+    if TERM_WINDOWS[window] is not None:
+        start = latest - pd.Timedelta(days=TERM_WINDOWS[window])
+    negative, positive = st.columns(2)
+    negative.caption('Termos mais negativos')
+    negative.dataframe(pipeline.termTable(df, user, start, end, negative=True))
+    positive.caption('Termos mais positivos')
+    positive.dataframe(pipeline.termTable(df, user, start, end, negative=False))
+    term = st.text_input('Tweets com o termo')
+    if term:
+        st.dataframe(pipeline.termTweets(df, term, user, start, end))
+
+def show_chart(df, fingerprint, kind, period=None):
+    with instrument.span('render', kind=kind, period=period) as attrs:
+        misses = instrument.counter('chart_spec.miss')
+        spec, attrs['bytes'] = chartSpec(df, fingerprint, kind, period)
+        if instrument.counter('chart_spec.miss') == misses:
+            instrument.count('chart_spec.hit')
+        instrument.count('chart_spec.bytes', attrs['bytes'])
+        st.vega_lite_chart(spec, use_container_width=True)
+
+def handle_show_diagnostics(run, load=None):
+    # Spans and counters of this run and of the last load, with their
+    # traces for chrome://tracing or Perfetto
+    recorders = [('Esta execução', run)]
+    if load is not None and load is not run:
+        recorders.append(('Último carregamento', load))
+    for title, recorder in recorders:
+        st.caption(title)
+        spans = pd.DataFrame(recorder.summary(), columns=['span', 'calls', 'total', 'max'])
+        spans[['total', 'max']] = (spans[['total', 'max']] * 1000).round(1)
+        st.dataframe(spans.set_index('span').rename(columns={'total': 'total (ms)', 'max': 'max (ms)'}))
+        if recorder.counters:
+            st.dataframe(pd.Series(dict(recorder.counters), name='valor'))
+        st.download_button('Exportar trace', recorder.chrome_trace(), file_name=f'trace-{int(recorder.started_at)}.json',
+                           mime='application/json', key=f'trace-{title}')
 ###########################  UI  ###########################
 
+# Spans and counters of this run, shown in the diagnostics panel
+recorder = instrument.start()
 
 candidates = st.sidebar.multiselect(
     label = 'Escolha os candidatos a serem analisados',
@@ -177,15 +334,43 @@ candidates = st.sidebar.multiselect(
 
 n_tweets = st.sidebar.slider('Escolha o número de tweets a serem analisados', 1000, 5000)
 
-tab1, tab2 = st.tabs(['Linha', 'Boxplot'])
+stream = st.sidebar.checkbox('Mostrar os gráficos durante o carregamento', value=True)
 
 if st.sidebar.button('Carregar tweets e analisar'):
-    st.session_state['df'] = handle_load_tweets(candidates, n_tweets)
-    
-    with tab1:
-        handle_show_analytics(st.session_state['df'], period='date')
-    with tab2:
-        handle_show_boxplot(st.session_state['df'])
+    if stream:
+        storeLoadedTweets(*handle_stream_tweets(candidates, n_tweets))
+    else:
+        storeLoadedTweets(*handle_load_tweets(candidates, n_tweets))
+    st.session_state['load_trace'] = recorder
+    st.session_state.pop('precomputed', None)
+
+if 'df' not in st.session_state:
+    manifest = pipeline.readManifest()
+    # None when the dataset was swapped or removed since the manifest was read
+    dataset = None if manifest is None else precomputedDataset(manifest['generated_at'])
+    if dataset is not None:
+        st.session_state['precomputed'], df, profiles = dataset
+        storeLoadedTweets(df, profiles)
+
+# Only the selected view is built, and the loaded tweets stay on screen
+# across reruns until the next load
+if 'df' in st.session_state:
+    if 'precomputed' in st.session_state:
+        generated_at = time.localtime(st.session_state['precomputed']['generated_at'])
+        st.sidebar.caption(f'Dados pré-calculados em {time.strftime("%d/%m/%Y %H:%M", generated_at)}')
+    with st.sidebar.expander('Uso de memória'):
+        # Builds a wide copy of the tweets, so only on request
+        if st.checkbox('Calcular', key='show_memory'):
+            st.dataframe(memoryTable(st.session_state['df'], st.session_state['profiles'],
+                                     st.session_state['fingerprint']) // 1024)
+    view = st.radio('Visualização', ['Linha', 'Boxplot', 'Termos'], horizontal=True)
+    if view == 'Linha':
+        period = st.radio('Período', list(PERIOD_LABELS), horizontal=True, format_func=PERIOD_LABELS.get, key='period')
+        handle_show_analytics(st.session_state['df'], period, st.session_state['fingerprint'])
+    elif view == 'Boxplot':
+        handle_show_boxplot(st.session_state['df'], st.session_state['fingerprint'])
+    else:
+        handle_show_terms(st.session_state['df'])
 
 else:
     st.markdown('# Twitter data dashboard')
@@ -193,4 +378,7 @@ else:
     st.write('Para usar o app, escolha os candidatos e o número de tweets.  \
               Depois clique em "Carregar tweets e analisar" e quando o carregamento for concluído (pode levar uns minutos),\
                navegue pelas abas para ver o comportamento ao longo do tempo nos gráficos de linha ou um resumo das métricas \
-                no boxplot')
\ No newline at end of file
+                no boxplot')
+
+with st.sidebar.expander('Diagnóstico'):
+    handle_show_diagnostics(recorder, st.session_state.get('load_trace'))
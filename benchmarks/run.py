@@ -0,0 +1,431 @@
+""" Benchmarks for the leia sentiment engine and the app's data pipeline.
+
+Synthetic Portuguese tweets are generated from the shipped lexicons and
+run through analyzer construction, polarity_scores, polarity_scores_batch
+and the tweet frame building path. Results are written as JSON and can be
+checked against a stored baseline; the golden check compares the scores of
+a fixed corpus with the ones the unoptimized leia gave, stored in
+golden.json, except for the intended changes listed with their reasons in
+golden_changes.json.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+    python benchmarks/run.py --golden-only
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --update-golden
+    python benchmarks/run.py --update-changes
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+
+import leia
+
+GOLDEN_FILE = os.path.join(BENCHMARK_DIRECTORY, 'golden.json')
+GOLDEN_CHANGES_FILE = os.path.join(BENCHMARK_DIRECTORY, 'golden_changes.json')
+# Commit whose leia.py scores golden.json: the engine before any optimization
+GOLDEN_REF = 'a9d9729'
+BASELINE_FILE = os.path.join(BENCHMARK_DIRECTORY, 'baseline.json')
+# Relative slowdown past which a result counts as a regression
+REGRESSION_THRESHOLD = 0.25
+# Scores may differ from the golden ones by at most this much
+GOLDEN_TOLERANCE = 1e-9
+
+FILLERS = ['o', 'a', 'de', 'que', 'e', 'do', 'da', 'em', 'um', 'para', 'com', 'os', 'no', 'se', 'na', 'por',
+           'mais', 'as', 'dos', 'como', 'ao', 'ele', 'das', 'seu', 'sua', 'ou', 'quando', 'muito', 'nos',
+           'governo', 'povo', 'Brasil', 'eleição', 'hoje', 'amanhã', 'presidente', 'debate', '#eleicoes2022']
+PUNCTUATION = ['.', '!', '?', '!!!', '...', ',', '?!']
+
+
+class Corpus(object):
+    """
+    Generator of synthetic tweets built from the lexicons leia ships with.
+    """
+    def __init__(self, seed=0, min_words=3, max_words=40, lexicon_rate=0.25, emoji_rate=0.05,
+                 negation_rate=0.04, booster_rate=0.04, upper_rate=0.03, duplicate_rate=0.0):
+        self.rng = random.Random(seed)
+        self.min_words = min_words
+        self.max_words = max_words
+        self.lexicon_rate = lexicon_rate
+        self.emoji_rate = emoji_rate
+        self.negation_rate = negation_rate
+        self.booster_rate = booster_rate
+        self.upper_rate = upper_rate
+        self.duplicate_rate = duplicate_rate
+
+        def read(path):
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+
+        self.lexicon = sorted(leia.parse_lex_dict(read(leia.LEXICON_FILE)))
+        self.emojis = sorted(leia.parse_emoji_dict(read(leia.EMOJI_LEXICON_FILE)))
+        self.negations = sorted(leia.parse_negate(read(leia.NEGATE_FILE)))
+        self.boosters = sorted(leia.parse_boosters(read(leia.BOOSTER_FILE)))
+
+    def word(self):
+        rng = self.rng
+        draw = rng.random()
+        for rate, words in ((self.lexicon_rate, self.lexicon), (self.emoji_rate, self.emojis),
+                            (self.negation_rate, self.negations), (self.booster_rate, self.boosters)):
+            if draw < rate:
+                word = rng.choice(words)
+                break
+            draw -= rate
+        else:
+            word = rng.choice(FILLERS)
+        if rng.random() < self.upper_rate:
+            word = word.upper()
+        return word
+
+    def text(self):
+        words = [self.word() for _ in range(self.rng.randint(self.min_words, self.max_words))]
+        if self.rng.random() < 0.5:
+            words.append(self.rng.choice(PUNCTUATION))
+        return ' '.join(words)
+
+    def texts(self, n):
+        texts = []
+        for _ in range(n):
+            if texts and self.rng.random() < self.duplicate_rate:
+                texts.append(self.rng.choice(texts))
+            else:
+                texts.append(self.text())
+        return texts
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def latency_result(latencies, total=None, n=None):
+    total = sum(latencies) if total is None else total
+    n = len(latencies) if n is None else n
+    return {
+        'n': n,
+        'seconds': total,
+        'per_sec': n / total if total else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def bench_construction(repeat):
+    # Cold reads the compiled lexicon snapshots from disk, warm reuses the
+    # ones already loaded in this process
+    cold = []
+    warm = []
+    for _ in range(repeat):
+        leia._compiled_lexicons.clear()
+        start = time.perf_counter()
+        leia.SentimentIntensityAnalyzer()
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        leia.SentimentIntensityAnalyzer()
+        warm.append(time.perf_counter() - start)
+    return {'analyzer_cold': latency_result(cold), 'analyzer_warm': latency_result(warm)}
+
+
+def bench_polarity_scores(texts):
+    # A fresh analyzer, so the token cache starts empty as after a restart
+    analyzer = leia.SentimentIntensityAnalyzer()
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        analyzer.polarity_scores(text)
+        latencies.append(time.perf_counter() - start)
+    return latency_result(latencies)
+
+
+def bench_polarity_scores_batch(texts, batch_size):
+    analyzer = leia.SentimentIntensityAnalyzer()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        batch_start = time.perf_counter()
+        analyzer.polarity_scores_batch(texts[i:i + batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+    result = latency_result(latencies, time.perf_counter() - start, len(texts))
+    result['batch_size'] = batch_size
+    return result
+
+
+def bench_frame_building(n_tweets, n_profiles):
+    # The pipeline's path from scraped rows to the normalized tweets table
+    import sources
+    import pipeline
+
+    source = sources.SyntheticSource(n_tweets // n_profiles)
+    rows = {f'https://twitter.com/perfil{i}': list(source.tweets(f'perfil{i}')) for i in range(n_profiles)}
+    start = time.perf_counter()
+    builders = {}
+    for twitter_url, records in rows.items():
+        builder = pipeline.TweetFrameBuilder()
+        for record in records:
+            builder.append(record)
+        builders[twitter_url] = builder
+    tweets_df, profiles_df = pipeline.assembleTweets(list(rows), builders, n_tweets // n_profiles)
+    total = time.perf_counter() - start
+    return {'n': len(tweets_df), 'seconds': total, 'per_sec': len(tweets_df) / total}
+
+
+def run_benchmarks(args):
+    texts = Corpus(seed=args.seed, max_words=args.max_words, emoji_rate=args.emoji_rate,
+                   negation_rate=args.negation_rate, booster_rate=args.booster_rate,
+                   duplicate_rate=args.duplicate_rate).texts(args.texts)
+    results = {}
+    results.update(bench_construction(args.repeat))
+    results['polarity_scores'] = bench_polarity_scores(texts)
+    results['polarity_scores_batch'] = bench_polarity_scores_batch(texts, args.batch_size)
+    if not args.skip_frames:
+        results['frame_building'] = bench_frame_building(args.frame_tweets, 5)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'corpus': {key: getattr(args, key) for key in ('seed', 'texts', 'max_words', 'emoji_rate',
+                                                           'negation_rate', 'booster_rate', 'duplicate_rate')},
+        },
+        'results': results,
+    }
+
+
+def check_baseline(report, baseline, threshold):
+    """
+    Return a message for every result slower than the baseline by more
+    than threshold, in throughput or in p99 latency.
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if base.get('per_sec') and result['per_sec'] < base['per_sec'] * (1 - threshold):
+            regressions.append(f'{name}: {result["per_sec"]:.1f}/s against {base["per_sec"]:.1f}/s')
+        if base.get('p99_ms') and result['p99_ms'] > base['p99_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p99 {result["p99_ms"]:.3f} ms against {base["p99_ms"]:.3f} ms')
+    return regressions
+
+
+# Multi-word negations around lexicon words, including ones whose first
+# word ('nao') has a valence of its own
+GOLDEN_NEGATIONS = ['nao consegue feliz', 'nao consegue ser feliz', 'nao consegue ficar tao feliz',
+                    'nao conseguem amar', 'nao e bom', 'nao estao felizes hoje', 'eles nao fazem nada bom',
+                    'raramente bom', 'raramente nao consegue feliz', 'nao consegue nao ser feliz']
+# Contrasts with 'mas', which the corpus fillers never produce
+GOLDEN_CONTRASTS = ['bom mas ruim', 'ruim mas bom', 'bom bom mas bom bom', 'freneticamente mas espantalhos',
+                    'dor loucos miserias mas amargo', 'rebelde harmonizadores feudalismo mas exigiu',
+                    'duvidando irritante mas lowballing devastacao brincadeira']
+
+# Why the scores of a golden text may intentionally differ from the
+# baseline ones; recorded with each change in golden_changes.json
+CHANGE_REASONS = {
+    'emoji': 'emojis are replaced by their descriptions before accent folding, which used to drop them',
+    'repeated-token': 'a repeated word gets the context of its own position instead of its first occurrence',
+    'mas': "'mas' scales the valences before and after it by position instead of by value",
+    'multi-word-negation': "multi-word negations such as 'nao consegue' negate the lexicon words after them",
+}
+
+
+def golden_texts():
+    return (Corpus(seed=20221002, emoji_rate=0.08, duplicate_rate=0.0).texts(1000) + GOLDEN_NEGATIONS +
+            GOLDEN_CONTRASTS)
+
+
+def change_reasons(analyzer, text):
+    """
+    The CHANGE_REASONS that apply to text.
+    """
+    words = text.lower().split()
+    reasons = []
+    if analyzer.emoji_starts.search(text):
+        reasons.append('emoji')
+    if len(set(words)) < len(words):
+        reasons.append('repeated-token')
+    if 'mas' in words:
+        reasons.append('mas')
+    if any(found[2] for found in leia.match_phrases(words, leia.NEGATE_TRIE).values()):
+        reasons.append('multi-word-negation')
+    return reasons
+
+
+def baseline_leia(ref=GOLDEN_REF):
+    """
+    Import leia.py as of the git commit ref, reading the shipped lexicons.
+    """
+    source = subprocess.run(['git', 'show', f'{ref}:leia.py'], cwd=os.path.dirname(BENCHMARK_DIRECTORY),
+                            check=True, capture_output=True).stdout
+    directory = tempfile.mkdtemp(prefix='leia-')
+    with open(os.path.join(directory, 'leia.py'), 'wb') as f:
+        f.write(source)
+    os.symlink(leia.LEXICON_DIRECTORY, os.path.join(directory, 'lexicons'))
+    spec = importlib.util.spec_from_file_location('baseline_leia', os.path.join(directory, 'leia.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write_rows(path, head, name, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        # One text per line, so changed scores show up as readable diffs
+        f.write('{%s, "%s": [\n' % (head, name))
+        f.write(',\n'.join(json.dumps(row, ensure_ascii=False) for row in rows))
+        f.write('\n]}\n')
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def update_golden(path=GOLDEN_FILE, ref=GOLDEN_REF):
+    """
+    Score the golden texts with the baseline leia, from before any of the
+    optimizations, and write them to path.
+    """
+    analyzer = baseline_leia(ref).SentimentIntensityAnalyzer()
+    golden = [[text] + [analyzer.polarity_scores(text)[key] for key in leia.SCORE_KEYS] for text in golden_texts()]
+    _write_rows(path, '"ref": %s, "keys": %s' % (json.dumps(ref), json.dumps(list(leia.SCORE_KEYS))),
+                'scores', golden)
+    return len(golden)
+
+
+def update_changes(path=GOLDEN_CHANGES_FILE, golden_path=GOLDEN_FILE, tolerance=GOLDEN_TOLERANCE):
+    """
+    Record the golden texts this tree scores differently from the baseline,
+    with the CHANGE_REASONS that apply to each. Returns the texts no reason
+    applies to, which are not recorded.
+    """
+    golden = _read_json(golden_path)
+    analyzer = leia.SentimentIntensityAnalyzer()
+    changes = []
+    unexplained = []
+    for row in golden['scores']:
+        scores = analyzer.polarity_scores(row[0])
+        current = [scores[key] for key in golden['keys']]
+        if all(abs(value - expected) <= tolerance for value, expected in zip(current, row[1:])):
+            continue
+        reasons = change_reasons(analyzer, row[0])
+        if reasons:
+            changes.append([row[0], reasons] + current)
+        else:
+            unexplained.append(row[0])
+    _write_rows(path, '"keys": %s, "reasons": %s' % (json.dumps(golden['keys']),
+                                                     json.dumps(CHANGE_REASONS, ensure_ascii=False)),
+                'changes', changes)
+    return unexplained
+
+
+def check_golden(path=GOLDEN_FILE, changes_path=GOLDEN_CHANGES_FILE, tolerance=GOLDEN_TOLERANCE):
+    """
+    Return a message for every golden text whose scores, through
+    polarity_scores or polarity_scores_batch, differ from the baseline ones
+    other than as recorded in golden_changes.json.
+    """
+    golden = _read_json(path)
+    changes = {row[0]: row for row in _read_json(changes_path)['changes']}
+    keys = golden['keys']
+    texts = [row[0] for row in golden['scores']]
+    analyzer = leia.SentimentIntensityAnalyzer()
+    batch = analyzer.polarity_scores_batch(texts)
+    mismatches = []
+    for i, row in enumerate(golden['scores']):
+        expected_scores = row[1:]
+        change = changes.get(row[0])
+        if change is not None:
+            unknown = set(change[1]) - set(CHANGE_REASONS)
+            if not change[1] or unknown:
+                mismatches.append(f'change without a known reason ({", ".join(sorted(unknown))}) for {row[0]!r}')
+            expected_scores = change[2:]
+        scores = analyzer.polarity_scores(row[0])
+        for key, expected in zip(keys, expected_scores):
+            for path_name, value in (('polarity_scores', scores[key]), ('polarity_scores_batch', batch[key][i])):
+                if abs(value - expected) > tolerance:
+                    mismatches.append(f'{path_name} {key}={value} instead of {expected} for {row[0]!r}')
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--texts', type=int, default=5000, help='number of texts to score')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-words', type=int, default=40)
+    parser.add_argument('--emoji-rate', type=float, default=0.05)
+    parser.add_argument('--negation-rate', type=float, default=0.04)
+    parser.add_argument('--booster-rate', type=float, default=0.04)
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20, help='analyzer constructions to time')
+    parser.add_argument('--frame-tweets', type=int, default=100000)
+    parser.add_argument('--skip-frames', action='store_true', help='skip the app frame building benchmark')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='fail on regressions against this results file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--save-baseline', help='write the results as the new baseline to this file')
+    parser.add_argument('--golden-only', action='store_true', help='only run the golden output check')
+    parser.add_argument('--update-golden', action='store_true',
+                        help=f'rescore golden.json with the leia.py of commit {GOLDEN_REF}')
+    parser.add_argument('--update-changes', action='store_true',
+                        help="record this tree's intended differences in golden_changes.json")
+    args = parser.parse_args(argv)
+
+    if args.update_golden or args.update_changes:
+        if args.update_golden:
+            print(f'golden: {update_golden()} texts written to {GOLDEN_FILE}')
+        if args.update_changes:
+            unexplained = update_changes()
+            for text in unexplained:
+                print(f'golden change without a reason: {text!r}')
+            print(f'golden: changes written to {GOLDEN_CHANGES_FILE}, {len(unexplained)} without a reason')
+            return 1 if unexplained else 0
+        return 0
+
+    mismatches = check_golden()
+    for mismatch in mismatches[:20]:
+        print(f'golden mismatch: {mismatch}')
+    print(f'golden: {len(mismatches)} mismatches')
+    if args.golden_only:
+        return 1 if mismatches else 0
+
+    report = run_benchmarks(args)
+    report['golden_mismatches'] = len(mismatches)
+    for name, result in report['results'].items():
+        line = f'{name:24} {result["per_sec"]:12.1f}/s'
+        if 'p50_ms' in result:
+            line += f'   p50 {result["p50_ms"]:9.3f} ms   p99 {result["p99_ms"]:9.3f} ms'
+        print(line)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # Results over another corpus are not comparable
+        base_corpus = baseline.get('meta', {}).get('corpus')
+        if base_corpus != report['meta']['corpus']:
+            print(f'baseline: corpus {base_corpus} differs from {report["meta"]["corpus"]}, not comparing')
+            return 1
+        regressions = check_baseline(report, baseline, args.threshold)
+        for regression in regressions:
+            print(f'regression: {regression}')
+    return 1 if mismatches or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
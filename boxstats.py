@@ -0,0 +1,208 @@
+""" Boxplot statistics computed server-side.
+Five-number summaries with whiskers per group, exact for small groups and
+read from a mergeable quantile sketch for large or growing ones, so new
+values update them without sorting the values already seen.
+"""
+
+import math
+import threading
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+# Groups up to this many values get exact quantiles; profiles reach 5001
+# tweets, so most are read off the sketch
+EXACT_MAX_VALUES = 1000
+# Relative error of the values returned by QuantileSketch
+SKETCH_ACCURACY = 0.01
+# Whiskers reach the furthest values within WHISKER_EXTENT IQRs of the box,
+# as mark_boxplot(extent=2) does
+WHISKER_EXTENT = 2
+# Keys kept by BoxStats, least recently synced dropped first
+MAX_KEYS = 256
+
+BoxSummary = namedtuple('BoxSummary', ['count', 'lower', 'q1', 'median', 'q3', 'upper'])
+
+
+class QuantileSketch(object):
+    """
+    Log-bucketed histogram of non-negative values (as in DDSketch): every
+    value v is counted in the bucket ceil(log_gamma(v)), and values read
+    back are within `accuracy` of the true ones relative to their size.
+    Sketches with the same accuracy merge by adding bucket counts, and
+    values can be removed again the same way they were added.
+    """
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _indices(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size and values.min() < 0:
+            raise ValueError('QuantileSketch only holds non-negative values')
+        positive = values[values > 0]
+        indices, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64),
+                                    return_counts=True)
+        return values.size - positive.size, indices, counts
+
+    def add(self, values):
+        zeros, indices, counts = self._indices(values)
+        self.zeros += zeros
+        self.count += zeros
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            self.bins[index] = self.bins.get(index, 0) + count
+            self.count += count
+
+    def remove(self, values):
+        """
+        Remove values previously added.
+        """
+        zeros, indices, counts = self._indices(values)
+        self.zeros -= zeros
+        self.count -= zeros
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            left = self.bins[index] - count
+            if left:
+                self.bins[index] = left
+            else:
+                del self.bins[index]
+            self.count -= count
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Only sketches with the same accuracy can be merged')
+        self.zeros += other.zeros
+        self.count += other.count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def _buckets(self):
+        # (value, count) in increasing order of value
+        if self.zeros:
+            yield 0.0, self.zeros
+        for index in sorted(self.bins):
+            yield self._value(index), self.bins[index]
+
+    def quantiles(self, qs):
+        """
+        Return the values at each quantile in qs, in increasing order of qs.
+        """
+        if not self.count:
+            return [math.nan] * len(qs)
+        result = []
+        ranks = iter([q * (self.count - 1) for q in qs])
+        rank = next(ranks)
+        seen = 0
+        for value, count in self._buckets():
+            seen += count
+            while rank is not None and rank < seen:
+                result.append(value)
+                rank = next(ranks, None)
+            if rank is None:
+                break
+        while len(result) < len(qs):
+            result.append(value)
+        return result
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def whiskers(self, low, high):
+        """
+        Return the smallest value >= low and the largest value <= high.
+        """
+        buckets = list(self._buckets())
+        lower = next((value for value, count in buckets if value >= low), math.nan)
+        upper = next((value for value, count in reversed(buckets) if value <= high), math.nan)
+        return lower, upper
+
+    def summary(self):
+        if not self.count:
+            return BoxSummary(0, *[math.nan] * 5)
+        q1, median, q3 = self.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        lower, upper = self.whiskers(q1 - WHISKER_EXTENT * iqr, q3 + WHISKER_EXTENT * iqr)
+        return BoxSummary(self.count, lower, q1, median, q3, upper)
+
+
+def exact_summary(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not values.size:
+        return BoxSummary(0, *[math.nan] * 5)
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    lower = values[values >= q1 - WHISKER_EXTENT * iqr].min()
+    upper = values[values <= q3 + WHISKER_EXTENT * iqr].max()
+    return BoxSummary(values.size, float(lower), float(q1), float(median), float(q3), float(upper))
+
+
+def changed_items(old_ids, old_values, ids, values):
+    """
+    Compare items, sorted unique ids with a row of values each, against
+    the ones held before. Returns a mask of the old items that were dropped
+    or changed and one of the items that are new or changed.
+    """
+    kept = np.zeros(len(old_ids), dtype=bool)
+    if not len(old_ids):
+        return ~kept, np.ones(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(old_ids, ids), len(old_ids) - 1)
+    old = np.asarray(old_values, dtype=np.float64)[positions]
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        old, values = old[:, None], values[:, None]
+    same = (old_ids[positions] == ids) & ((old == values) | (np.isnan(old) & np.isnan(values))).all(axis=1)
+    kept[positions[same]] = True
+    return ~kept, ~same
+
+
+class BoxStats(object):
+    """
+    Boxplot summaries per key, e.g. (dataset, username, metric), of the
+    values of a set of items such as tweets. sync() makes a key hold
+    exactly the given items: only new, changed and dropped items touch its
+    sketch. The max_keys keys synced last are kept.
+    """
+    def __init__(self, exact_max_values=EXACT_MAX_VALUES, accuracy=SKETCH_ACCURACY, max_keys=MAX_KEYS):
+        self.exact_max_values = exact_max_values
+        self.accuracy = accuracy
+        self.max_keys = max_keys
+        # key -> (sorted ids, their values, sketch)
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def sync(self, key, ids, values):
+        """
+        Make key hold exactly the given items and return its BoxSummary.
+        """
+        ids, first = np.unique(np.asarray(ids, dtype=np.int64), return_index=True)
+        values = np.asarray(values, dtype=np.float64)[first]
+        with self.lock:
+            old_ids, old_values, sketch = self.keys.pop(key, (ids[:0], values[:0], None))
+            if sketch is None:
+                sketch = QuantileSketch(self.accuracy)
+            removed, added = changed_items(old_ids, old_values, ids, values)
+            sketch.remove(old_values[removed])
+            sketch.add(values[added])
+            self.keys[key] = (ids, values, sketch)
+            while len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+            return self._summary(values, sketch)
+
+    def _summary(self, values, sketch):
+        if len(values) <= self.exact_max_values:
+            return exact_summary(values)
+        return sketch.summary()
+
+    def summary(self, key):
+        with self.lock:
+            if key not in self.keys:
+                return exact_summary([])
+            ids, values, sketch = self.keys[key]
+            return self._summary(values, sketch)
@@ -0,0 +1,129 @@
+""" Lightweight timing spans and counters for the dashboard's hot paths.
+A Recorder collects what happens during one script run (or one load);
+span() and count() record into the recorder active in the current context
+and do nothing when there is none. Functions handed to worker threads are
+wrapped with bind() so they record into the same recorder.
+
+Finished spans are also logged as JSON lines on the 'dashboard.trace'
+logger, enabled with TRACE_LOG=1, and a recorder exports itself in the
+Chrome trace event format (chrome://tracing, Perfetto).
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import namedtuple, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger('dashboard.trace')
+logger.setLevel(logging.INFO if os.environ.get('TRACE_LOG') else logging.WARNING)
+if os.environ.get('TRACE_LOG') and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.propagate = False
+
+Span = namedtuple('Span', ['name', 'start', 'seconds', 'thread', 'attrs'])
+
+_recorder = contextvars.ContextVar('recorder', default=None)
+
+
+class Recorder(object):
+    def __init__(self, name='run'):
+        self.name = name
+        self.origin = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add_span(self, name, start, seconds, attrs):
+        span = Span(name, start - self.origin, seconds, threading.current_thread().name, attrs)
+        with self.lock:
+            self.spans.append(span)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({'trace': self.name, 'span': name, 'ms': round(seconds * 1000, 3), **attrs},
+                                   default=str))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    def summary(self):
+        """
+        Return [(name, calls, total seconds, max seconds)] in order of first use.
+        """
+        totals = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            calls, total, longest = totals.get(span.name, (0, 0.0, 0.0))
+            totals[span.name] = (calls + 1, total + span.seconds, max(longest, span.seconds))
+        return [(name,) + values for name, values in totals.items()]
+
+    def chrome_trace(self):
+        with self.lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        threads = {}
+        events = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads))
+            events.append({'name': span.name, 'ph': 'X', 'ts': span.start * 1e6, 'dur': span.seconds * 1e6,
+                           'pid': 0, 'tid': tid, 'args': span.attrs})
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': thread}}
+                      for thread, tid in threads.items())
+        return json.dumps({'traceEvents': events, 'otherData': {'trace': self.name, 'counters': counters}},
+                          default=str)
+
+
+def start(name='run'):
+    """
+    Make a new recorder the active one in this context and return it.
+    """
+    recorder = Recorder(name)
+    _recorder.set(recorder)
+    return recorder
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the block as a span; the yielded dict takes more attributes.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield attrs
+        return
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        recorder.add_span(name, start, time.perf_counter() - start, attrs)
+
+
+def count(name, value=1):
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def counter(name):
+    recorder = _recorder.get()
+    return 0 if recorder is None else recorder.counter(name)
+
+
+def bind(function):
+    """
+    Wrap function to run in a copy of the current context, e.g. in a
+    worker thread, so it records into the active recorder.
+    """
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+    return bound
@@ -13,10 +13,22 @@ Repositório: https://github.com/cjhutto/vaderSentiment
 import re
 import math
 import unicodedata
-from itertools import product
 import os
+import zlib
+import marshal
+import functools
+from collections import namedtuple
 
 PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+LEXICON_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'lexicons')
+
+LEXICON_FILE = os.path.join(LEXICON_DIRECTORY, 'vader_lexicon_ptbr.txt')
+EMOJI_LEXICON_FILE = os.path.join(LEXICON_DIRECTORY, 'emoji_utf8_lexicon_ptbr.txt')
+NEGATE_FILE = os.path.join(LEXICON_DIRECTORY, 'negate.txt')
+BOOSTER_FILE = os.path.join(LEXICON_DIRECTORY, 'booster.txt')
+
+# Marshalled snapshots of the parsed lexicon files (see load_compiled)
+COMPILED_LEXICON_DIRECTORY = os.path.join(LEXICON_DIRECTORY, '.compiled')
 
 # Empirically derived mean sentiment intensity rating increase for booster words
 # TODO: Portuguese update
@@ -29,44 +41,237 @@ C_INCR = 0.733
 N_SCALAR = -0.74
 
 # For removing punctuation
-REGEX_REMOVE_PUNCTUATION = re.compile('[%s]' % re.escape('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'))
+PUNCTUATION = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+REGEX_REMOVE_PUNCTUATION = re.compile('[%s]' % re.escape(PUNCTUATION))
 
 PUNC_LIST = [
     ".", "!", "?", ",", ";", ":", "-", "'", "\"", "...",
     "—", "–", "!?", "?!", "!!", "!!!", "??", "???", "?!?", 
     "!?!", "?!?!", "!?!?"
 ]
+PUNC_SET = frozenset(PUNC_LIST)
+PUNC_CHARS = frozenset(''.join(PUNC_LIST))
+
+# Dashes are in PUNC_LIST but not in PUNCTUATION, so they are peeled one at a time
+DASHES = '—–'
+
+
+def parse_lex_dict(text):
+    """
+    Convert the contents of a lexicon file to a dictionary
+    """
+    lex_dict = {}
+    for line in text.split('\n'):
+        if len(line) < 1:
+            continue
+        (word, measure) = line.strip().split('\t')[0:2]
+        lex_dict[word] = float(measure)
+    return lex_dict
+
+
+def parse_emoji_dict(text):
+    """
+    Convert the contents of an emoji lexicon file to a dictionary
+    """
+    emoji_dict = {}
+    for line in text.split('\n'):
+        if len(line) < 1:
+            continue
+        (emoji, description) = line.strip().split('\t')[0:2]
+        emoji_dict[emoji] = description
+    return emoji_dict
+
+
+def parse_emoji_trie(text):
+    """
+    Convert the contents of an emoji lexicon file to a character trie:
+    nested {char: node} dicts, with the description stored under '' at the
+    node where an emoji (possibly several code points long) ends
+    """
+    trie = {}
+    for emoji, description in parse_emoji_dict(text).items():
+        node = trie
+        for char in emoji:
+            node = node.setdefault(char, {})
+        node[''] = description
+    return trie
+
+
+def parse_negate(text):
+    """
+    Convert the contents of a negation file to a list of negations
+    """
+    return [t.strip() for t in text.splitlines()]
+
+
+def parse_boosters(text):
+    """
+    Convert the contents of a booster file to a {booster: 'INCR' | 'DECR'} dictionary
+    """
+    boosters = {}
+    for boost in text.splitlines():
+        parts = boost.strip().split(' ')
+        boosters[' '.join(parts[:-1])] = parts[-1]
+    return boosters
+
+
+# Bump when a parse_* function changes, to invalidate existing snapshots
+COMPILED_LEXICON_VERSION = 1
+
+_compiled_lexicons = {}
+
+
+def load_compiled(path, parse):
+    """
+    parse(contents of path), through a marshalled snapshot under
+    COMPILED_LEXICON_DIRECTORY.
+    Snapshots are keyed by a SHA-256 of the file, so they are rebuilt
+    whenever the .txt changes; a file whose size and mtime still match its
+    snapshot is not re-hashed. Each call returns a fresh copy.
+    """
+    st = os.stat(path)
+    stat = [st.st_size, st.st_mtime_ns]
+    memo_key = (os.path.abspath(path), parse.__name__)
+    memo = _compiled_lexicons.get(memo_key)
+    if memo is not None and memo[0] == stat:
+        return memo[1].copy()
+
+    name = '%08x' % zlib.crc32('\0'.join(memo_key).encode())
+    compiled_file = os.path.join(COMPILED_LEXICON_DIRECTORY, name + '.marshal')
+    try:
+        with open(compiled_file, 'rb') as f:
+            compiled = marshal.loads(f.read())
+    except Exception:
+        # Missing, truncated or written by another Python version
+        compiled = {}
+
+    if compiled.get('stat') != stat:
+        import hashlib
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        key = '%s:%d:%s' % (parse.__name__, COMPILED_LEXICON_VERSION, hashlib.sha256(source).hexdigest())
+        if compiled.get('key') != key:
+            compiled = {'key': key, 'data': parse(source.decode('utf-8'))}
+        compiled['stat'] = stat
+
+        # Write to a temporary file first so concurrent readers never see a partial snapshot
+        try:
+            import tempfile
+
+            os.makedirs(COMPILED_LEXICON_DIRECTORY, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(dir=COMPILED_LEXICON_DIRECTORY, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(compiled, f)
+            os.replace(tmp_file, compiled_file)
+        except OSError:
+            pass
+
+    _compiled_lexicons[memo_key] = (stat, compiled['data'])
+    return compiled['data'].copy()
+
 
 # Negations (Portuguese)
-NEGATE = [t.strip() for t in open(
-    os.path.join(PACKAGE_DIRECTORY, 'lexicons', 'negate.txt')
-)]
+NEGATE = load_compiled(NEGATE_FILE, parse_negate)
 
 # Booster/dampener 'intensifiers' or 'degree adverbs' (Portuguese)
-boosters = []
-for boost in open(os.path.join(PACKAGE_DIRECTORY, 'lexicons', 'booster.txt')):
-    parts = boost.strip().split(' ')
-    boosters.append([' '.join(parts[:-1]), parts[-1]])
-
 BOOSTER_DICT = {}
-for t, v in boosters: 
+for t, v in load_compiled(BOOSTER_FILE, parse_boosters).items():
     BOOSTER_DICT[t] = B_INCR if v == 'INCR' else B_DECR
 
+NEGATE_SET = frozenset(NEGATE)
+
+
+# Keys of the dict returned by polarity_scores, in column order
+SCORE_KEYS = ('neg', 'neu', 'pos', 'compound')
+NO_SCORE = (0.0, 0.0, 0.0, 0.0)
+
+# Per-token facts looked up once per distinct token (see SentimentIntensityAnalyzer.token_info)
+TokenInfo = namedtuple('TokenInfo', ['lower', 'valence', 'booster', 'negation', 'is_upper'])
+
+# A lexicon word found in a text: its valence as it counted towards the
+# score, whether the context flipped its sign and whether a booster or
+# dampener preceded it
+LexiconHit = namedtuple('LexiconHit', ['token', 'valence', 'negated', 'boosted'])
+
+# Default number of distinct tokens each analyzer keeps in its token cache
+TOKEN_CACHE_SIZE = 2 ** 16
+
+# Below this many texts score_parallel stays serial: pool start-up costs more than it saves
+PARALLEL_MIN_TEXTS = 2000
 
 # Check for special case idioms containing lexicon words
 # TODO: Portuguese
 SPECIAL_CASE_IDIOMS = {}
 
 
+def build_phrase_trie(idioms=None, boosters=None, negate=None):
+    """
+    Word-level trie of the multi-word entries of SPECIAL_CASE_IDIOMS,
+    BOOSTER_DICT and NEGATE (or of the given replacements).
+    Nodes are {word: node} dicts; where a phrase ends, the '' key holds
+    [idiom valence, booster scalar, is negation], with None for the roles
+    the phrase doesn't have.
+    """
+    trie = {}
+
+    def entry(phrase):
+        # Phrases are matched word by word, joined by single spaces
+        words = phrase.split(' ')
+        if len(words) < 2 or '' in words:
+            return [None, None, False]
+        node = trie
+        for word in words:
+            node = node.setdefault(word, {})
+        return node.setdefault('', [None, None, False])
+
+    for phrase, value in (SPECIAL_CASE_IDIOMS if idioms is None else idioms).items():
+        entry(phrase)[0] = value
+    for phrase, value in (BOOSTER_DICT if boosters is None else boosters).items():
+        entry(phrase)[1] = value
+    for phrase in (NEGATE if negate is None else negate):
+        entry(phrase)[2] = True
+    return trie
+
+
+# Multi-word negations on their own, for negated(); rebuild after editing NEGATE
+NEGATE_TRIE = build_phrase_trie({}, {}, NEGATE)
+
+
+def match_phrases(words, trie):
+    """
+    All phrases of `trie` (see build_phrase_trie) occurring in the
+    lowercased `words`, as {(start, end): entry} with `end` exclusive.
+    One pass over the words; the work per word is bounded by the longest
+    phrase, not by how many phrases the trie holds.
+    """
+    spans = {}
+    n = len(words)
+    for start in range(n):
+        node = trie.get(words[start])
+        end = start + 1
+        while node is not None:
+            found = node.get('')
+            if found is not None:
+                spans[(start, end)] = found
+            if end == n:
+                break
+            node = node.get(words[end])
+            end += 1
+    return spans
+
+
 def negated(input_words, include_nt=True):
     """
     Determine if input contains negation words
     """
     input_words = [str(w).lower() for w in input_words]
-    neg_words = []
-    neg_words.extend(NEGATE)
-    for word in neg_words:
-        if word in input_words:
+    if not NEGATE_SET.isdisjoint(input_words):
+        return True
+    if NEGATE_TRIE.keys().isdisjoint(input_words):
+        return False
+    for found in match_phrases(input_words, NEGATE_TRIE).values():
+        if found[2]:
             return True
     # if include_nt:
     #     for word in input_words:
@@ -75,6 +280,61 @@ def negated(input_words, include_nt=True):
     return False
 
 
+def emoji_start_pattern(trie):
+    """
+    Compiled character class matching the first characters of the emojis
+    in `trie`. Nearby code points are merged into ranges: a class listing
+    every character one by one makes re.search crawl, and the few extra
+    characters the ranges let through are rejected by the trie.
+    """
+    ranges = []
+    for code in sorted(map(ord, trie)):
+        if ranges and code - ranges[-1][1] <= 16:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    return re.compile('[%s]' % ''.join(
+        '%s-%s' % (re.escape(chr(low)), re.escape(chr(high))) for low, high in ranges
+    ))
+
+
+def replace_emojis(text, trie, starts):
+    """
+    Replace every emoji found in `trie` (see parse_emoji_trie) with its
+    description, in one left-to-right scan taking the longest match.
+    `starts` (see emoji_start_pattern) is used to jump between candidate
+    positions. Emojis glued to words or to
+    each other are replaced too.
+    """
+    pieces = []
+    pos = 0
+    n = len(text)
+    match = starts.search(text)
+    while match:
+        i = match.start()
+        node = trie
+        j = i
+        end = description = None
+        while j < n and text[j] in node:
+            node = node[text[j]]
+            j += 1
+            if '' in node:
+                end = j
+                description = node['']
+        if end is None:
+            match = starts.search(text, i + 1)
+            continue
+        pieces.append(text[pos:i])
+        pieces.append(' %s ' % description)
+        pos = end
+        match = starts.search(text, end)
+
+    if not pieces:
+        return text
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
 def normalize(score, alpha=15):
     """
     Normalize the score to be between -1 and 1 using an alpha that
@@ -111,15 +371,22 @@ def scalar_inc_dec(word, valence, is_cap_diff):
     Check if the preceding words increase, decrease, or negate/nullify the
     valence
     """
+    return booster_scalar(BOOSTER_DICT.get(word.lower()), word.isupper(), valence, is_cap_diff)
+
+
+def booster_scalar(booster, is_upper, valence, is_cap_diff):
+    """
+    scalar_inc_dec for a word already looked up in BOOSTER_DICT
+    (booster is None when the word isn't a booster)
+    """
     scalar = 0.0
-    word_lower = word.lower()
-    if word_lower in BOOSTER_DICT:
-        scalar = BOOSTER_DICT[word_lower]
+    if booster is not None:
+        scalar = booster
         if valence < 0:
             scalar *= -1
         
         # Check if booster/dampener word is in ALLCAPS (while others aren't)
-        if word.isupper() and is_cap_diff:
+        if is_upper and is_cap_diff:
             if valence > 0:
                 scalar += C_INCR
             else:
@@ -132,40 +399,99 @@ class SentiText(object):
     Identify sentiment-relevant string-level properties of input text.
     """
 
-    def __init__(self, text):
+    def __init__(self, text, token_info=None, phrase_trie=None):
         if not isinstance(text, str):
             text = str(text).encode('utf-8')
         self.text = text
         self.words_and_emoticons = self._words_and_emoticons()
+
+        # Lowercased once here instead of once per lookback check.
+        # With an analyzer's token_info, each token also carries its
+        # lexicon/booster/negation lookups as a TokenInfo.
+        if token_info is None:
+            self.tokens = None
+            self.words_lower = [w.lower() for w in self.words_and_emoticons]
+        else:
+            self.tokens = [token_info(w) for w in self.words_and_emoticons]
+            self.words_lower = [t.lower for t in self.tokens]
+
+        # Multi-word idioms, boosters and negations found in the text
+        if phrase_trie is None:
+            phrase_trie = build_phrase_trie()
+        self.phrases = match_phrases(self.words_lower, phrase_trie)
+        # Index of a negation phrase's last word -> start indexes of the
+        # negation phrases ending there
+        self.negation_phrases = {}
+        for (start, end), found in self.phrases.items():
+            if found[2]:
+                self.negation_phrases.setdefault(end - 1, []).append(start)
         
         # Doesn't separate words from adjacent
         # punctuation (keeps emoticons & contractions)
         self.is_cap_diff = allcap_differential(self.words_and_emoticons)
 
 
-    def _words_plus_punc(self):
+    def negated_at(self, j, i):
         """
-        Returns mapping of form:
-        {
-            'cat,': 'cat',
-            ',cat': 'cat',
-        }
+        Whether the word at position j negates the lexicon word at i (j < i).
+        Besides single negation words, a multi-word negation ending at j
+        counts, unless one of its own negation words sits in the three
+        words before i and is counted there on its own. Words with a
+        lexicon valence of their own, such as 'nao', never are, as only
+        words without one are checked for negation.
         """
-        no_punc_text = REGEX_REMOVE_PUNCTUATION.sub('', self.text)
-        
-        # Removes punctuation (but loses emoticons & contractions)
-        words_only = no_punc_text.split()
-        
-        # Remove singletons
-        words_only = set(w for w in words_only if len(w) > 1)
-        
-        # The product gives ('cat', ',') and (',', 'cat')
-        punc_before = {''.join(p): p[1] for p in product(PUNC_LIST, words_only)}
-        punc_after = {''.join(p): p[0] for p in product(words_only, PUNC_LIST)}
-        words_punc_dict = punc_before
-        words_punc_dict.update(punc_after)
+        if self.words_lower[j] in NEGATE_SET:
+            return True
+        for start in self.negation_phrases.get(j, ()):
+            if not any(self._counted_negation(k) for k in range(max(start, i - 3), j)):
+                return True
+        return False
+
 
-        return words_punc_dict
+    def _counted_negation(self, k):
+        if self.words_lower[k] not in NEGATE_SET:
+            return False
+        return self.tokens is None or self.tokens[k].valence is None
+
+
+    def _words_only(self):
+        """
+        Set of words longer than one character once punctuation is removed
+        """
+        if self._words_only_set is None:
+            # Removes punctuation (but loses emoticons & contractions)
+            words_only = REGEX_REMOVE_PUNCTUATION.sub('', self.text).split()
+            
+            # Remove singletons
+            self._words_only_set = set(w for w in words_only if len(w) > 1)
+        return self._words_only_set
+
+
+    @staticmethod
+    def _is_stripped_word(rest):
+        # A token minus its PUNCTUATION run is a word of the text exactly
+        # when no punctuation is left inside it
+        return len(rest) > 1 and REGEX_REMOVE_PUNCTUATION.search(rest) is None
+
+
+    def _strip_punc(self, token):
+        """
+        Strip one PUNC_LIST entry from either end of a token, as in
+        'cat,' -> 'cat' and ',cat' -> 'cat', when what remains is a word
+        of the text. A trailing entry takes precedence over a leading one.
+        """
+        rest = token.rstrip(PUNCTUATION)
+        if token[len(rest):] in PUNC_SET and self._is_stripped_word(rest):
+            return rest
+        if token[-1] in DASHES and token[:-1] in self._words_only():
+            return token[:-1]
+
+        rest = token.lstrip(PUNCTUATION)
+        if token[:len(token) - len(rest)] in PUNC_SET and self._is_stripped_word(rest):
+            return rest
+        if token[0] in DASHES and token[1:] in self._words_only():
+            return token[1:]
+        return token
 
 
     def _words_and_emoticons(self):
@@ -174,12 +500,14 @@ class SentiText(object):
         Leaves contractions and most emoticons
             Does not preserve punc-plus-letter emoticons (e.g. :D)
         """
-        wes = self.text.split()
-        words_punc_dict = self._words_plus_punc()
-        wes = [we for we in wes if len(we) > 1]
-        for i, we in enumerate(wes):
-            if we in words_punc_dict:
-                wes[i] = words_punc_dict[we]
+        self._words_only_set = None
+        wes = []
+        for we in self.text.split():
+            if len(we) < 2:
+                continue
+            if we[0] in PUNC_CHARS or we[-1] in PUNC_CHARS:
+                we = self._strip_punc(we)
+            wes.append(we)
         return wes
 
 
@@ -190,50 +518,60 @@ class SentimentIntensityAnalyzer(object):
 
     def __init__(
             self,
-            lexicon_file=os.path.join(
-                PACKAGE_DIRECTORY,
-                'lexicons',
-                'vader_lexicon_ptbr.txt'
-            ),
-            emoji_lexicon=os.path.join(
-                PACKAGE_DIRECTORY,
-                'lexicons',
-                'emoji_utf8_lexicon_ptbr.txt'
-            )
+            lexicon_file=LEXICON_FILE,
+            emoji_lexicon=EMOJI_LEXICON_FILE,
+            token_cache_size=TOKEN_CACHE_SIZE
     ):
-        with open(lexicon_file, encoding='utf-8') as f:
-            self.lexicon_full_filepath = f.read()
-        self.lexicon = self.make_lex_dict()
+        self.lexicon_file = lexicon_file
+        self.emoji_lexicon = emoji_lexicon
+
+        self.lexicon = load_compiled(lexicon_file, parse_lex_dict)
+        self.emojis = load_compiled(emoji_lexicon, parse_emoji_dict)
+        # Matcher used by polarity_scores; built from the file, not from self.emojis
+        self.emoji_trie = load_compiled(emoji_lexicon, parse_emoji_trie)
+        self.emoji_starts = emoji_start_pattern(self.emoji_trie)
+
+        # LRU cache of token -> TokenInfo. Call token_info.cache_clear()
+        # after editing self.lexicon or BOOSTER_DICT.
+        self.token_info = functools.lru_cache(maxsize=token_cache_size)(self._make_token_info)
+
+        # Rebuild with build_phrase_trie() after editing SPECIAL_CASE_IDIOMS,
+        # BOOSTER_DICT or NEGATE
+        self.phrase_trie = build_phrase_trie()
+
+
+    def _make_token_info(self, token):
+        lower = token.lower()
+        return TokenInfo(
+            lower,
+            self.lexicon.get(lower),
+            BOOSTER_DICT.get(lower),
+            lower in NEGATE_SET,
+            token.isupper()
+        )
 
-        with open(emoji_lexicon, encoding='utf-8') as f:
-            self.emoji_full_filepath = f.read()
-        self.emojis = self.make_emoji_dict()
+
+    def token_cache_info(self):
+        """
+        Hits, misses, maxsize and current size of the token cache
+        """
+        return self.token_info.cache_info()
 
 
     def make_lex_dict(self):
         """
         Convert lexicon file to a dictionary
         """
-        lex_dict = {}
-        for line in self.lexicon_full_filepath.split('\n'):
-            if len(line) < 1:
-                continue
-            (word, measure) = line.strip().split('\t')[0:2]
-            lex_dict[word] = float(measure)
-        return lex_dict
+        with open(self.lexicon_file, encoding='utf-8') as f:
+            return parse_lex_dict(f.read())
 
 
     def make_emoji_dict(self):
         """
         Convert emoji lexicon file to a dictionary
         """
-        emoji_dict = {}
-        for line in self.emoji_full_filepath.split('\n'):
-            if len(line) < 1:
-                continue
-            (emoji, description) = line.strip().split('\t')[0:2]
-            emoji_dict[emoji] = description
-        return emoji_dict
+        with open(self.emoji_lexicon, encoding='utf-8') as f:
+            return parse_emoji_dict(f.read())
 
 
     def polarity_scores(self, text):
@@ -242,53 +580,151 @@ class SentimentIntensityAnalyzer(object):
         Positive values are positive valence, negative value are negative
         valence.
         """
+        return dict(zip(SCORE_KEYS, self._polarity_tuple(text)))
 
-        # Remove acentos
-        text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('ASCII')
-
-        # convert emojis to their textual descriptions
-        text_token_list = text.split()
-        text_no_emoji_lst = []
-        for token in text_token_list:
-            if token in self.emojis:
-                # get the textual description
-                description = self.emojis[token]
-                text_no_emoji_lst.append(description)
-            else:
-                text_no_emoji_lst.append(token)
-        text = " ".join(x for x in text_no_emoji_lst)
 
-        sentitext = SentiText(text)
+    def polarity_scores_batch(self, texts, hits=None):
+        """
+        Score an iterable of texts in one call.
+        Returns a dict mapping each of SCORE_KEYS to a NumPy float array
+        aligned with the input order. Missing values (None/NaN) score 0.
+        If `hits` is a list, a list of the LexiconHit of each text is
+        appended to it, in input order.
+        """
+        return _score_columns(self._score_rows(texts, hits))
+
+
+    def score_parallel(self, texts, workers=None, chunksize=None, min_texts=PARALLEL_MIN_TEXTS):
+        """
+        polarity_scores_batch spread over a process pool.
+        Each worker builds its own analyzer once (or inherits this one when
+        processes are forked), so only the texts are sent to the workers.
+        Results come back in input order. Inputs shorter than `min_texts`,
+        or workers=1, are scored serially.
+        """
+        import multiprocessing
+
+        texts = list(texts)
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(texts) < min_texts:
+            return self.polarity_scores_batch(texts)
+
+        if chunksize is None:
+            chunksize = -(-len(texts) // (workers * 4))
+        chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+
+        global _worker_analyzer
+        _worker_analyzer = self
+        try:
+            with multiprocessing.Pool(
+                    min(workers, len(chunks)),
+                    initializer=_init_worker,
+                    initargs=(self.lexicon_file, self.emoji_lexicon)
+            ) as pool:
+                rows = []
+                for chunk_rows in pool.imap(_score_chunk, chunks):
+                    rows.extend(chunk_rows)
+        finally:
+            _worker_analyzer = None
+
+        return _score_columns(rows)
+
+
+    def score_series(self, texts, workers=1):
+        """
+        Score a pandas Series (or any iterable) of texts.
+        Returns a DataFrame with neg/neu/pos/compound columns, indexed like
+        the input Series. workers != 1 goes through score_parallel.
+        """
+        import pandas as pd
+
+        if isinstance(texts, pd.Series):
+            index = texts.index
+        else:
+            texts = list(texts)
+            index = None
+        if workers == 1:
+            scores = self.polarity_scores_batch(texts)
+        else:
+            scores = self.score_parallel(texts, workers=workers)
+        return pd.DataFrame(scores, index=index)
+
+
+    def _score_rows(self, texts, hits=None):
+        """
+        List of (neg, neu, pos, compound) tuples, one per text
+        """
+        score = self._polarity_tuple
+        if hits is None:
+            return [score(text) if isinstance(text, str) else NO_SCORE for text in texts]
+        rows = []
+        for text in texts:
+            text_hits = []
+            rows.append(score(text, text_hits) if isinstance(text, str) else NO_SCORE)
+            hits.append(text_hits)
+        return rows
+
+
+    def _polarity_tuple(self, text, hits=None):
+        """
+        polarity_scores without the dict: (neg, neu, pos, compound).
+        The text's LexiconHit are appended to `hits` when given.
+        """
+
+        if not text.isascii():
+            # convert emojis to their textual descriptions. This has to run
+            # before the accents are removed, which also drops the emojis.
+            text = replace_emojis(text, self.emoji_trie, self.emoji_starts)
+
+            # Remove acentos
+            text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('ASCII')
+
+        sentitext = SentiText(text, self.token_info, self.phrase_trie)
 
         sentiments = []
-        words_and_emoticons = sentitext.words_and_emoticons
-        for item in words_and_emoticons:
+        tokens = sentitext.tokens
+        # Positions come from enumerate rather than list.index(), which was
+        # quadratic and gave every repeated word the context (preceding
+        # boosters, negations, 'mas') of its first occurrence.
+        for i, item in enumerate(sentitext.words_and_emoticons):
             valence = 0
-            i = words_and_emoticons.index(item)
             # check for vader_lexicon words that may be used as modifiers or negations
-            if item.lower() in BOOSTER_DICT:
+            if tokens[i].booster is not None:
                 sentiments.append(valence)
                 continue
 
             sentiments = self.sentiment_valence(valence, sentitext, item, i, sentiments)
 
-        sentiments = self._but_check(words_and_emoticons, sentiments)
-        valence_dict = self.score_valence(sentiments, text)
+        sentiments = self._but_check(sentitext.words_lower, sentiments)
+        if hits is not None:
+            self._lexicon_hits(tokens, sentiments, hits)
+        return self._valence_tuple(sentiments, text)
 
-        return valence_dict
+
+    @staticmethod
+    def _lexicon_hits(tokens, sentiments, hits):
+        for i, token in enumerate(tokens):
+            valence = sentiments[i]
+            if token.valence is None or not valence:
+                continue
+            boosted = any(tokens[j].valence is None and tokens[j].booster is not None
+                          for j in range(max(i - 3, 0), i))
+            hits.append(LexiconHit(token.lower, valence, valence * token.valence < 0, boosted))
 
 
     def sentiment_valence(self, valence, sentitext, item, i, sentiments):
         is_cap_diff = sentitext.is_cap_diff
-        words_and_emoticons = sentitext.words_and_emoticons
-        item_lowercase = item.lower()
-        if item_lowercase in self.lexicon:
+        tokens = sentitext.tokens
+        if tokens is None:
+            tokens = [self._make_token_info(w) for w in sentitext.words_and_emoticons]
+        token = tokens[i]
+        if token.valence is not None:
 
             # Get the sentiment valence
-            valence = self.lexicon[item_lowercase]
+            valence = token.valence
 
             # Check if sentiment laden word is in ALL CAPS (while others aren't)
-            if item.isupper() and is_cap_diff:
+            if token.is_upper and is_cap_diff:
                 if valence > 0:
                     valence += C_INCR
                 else:
@@ -298,16 +734,17 @@ class SentimentIntensityAnalyzer(object):
                 # Dampen the scalar modifier of preceding words and emoticons
                 # (excluding the ones that immediately preceed the item) based
                 # on their distance from the current item.
-                if i > start_i and words_and_emoticons[i - (start_i + 1)].lower() not in self.lexicon:
-                    s = scalar_inc_dec(words_and_emoticons[i - (start_i + 1)], valence, is_cap_diff)
+                if i > start_i and tokens[i - (start_i + 1)].valence is None:
+                    preceding = tokens[i - (start_i + 1)]
+                    s = booster_scalar(preceding.booster, preceding.is_upper, valence, is_cap_diff)
                     if start_i == 1 and s != 0:
                         s = s * 0.95
                     if start_i == 2 and s != 0:
                         s = s * 0.9
                     valence = valence + s
-                    valence = self._negation_check(valence, words_and_emoticons, start_i, i)
+                    valence = self._negation_check(valence, sentitext, start_i, i)
                     if start_i == 2:
-                        valence = self._special_idioms_check(valence, words_and_emoticons, i)
+                        valence = self._special_idioms_check(valence, sentitext, i)
 
             # valence = self._least_check(valence, words_and_emoticons, i)
         sentiments.append(valence)
@@ -329,92 +766,57 @@ class SentimentIntensityAnalyzer(object):
 
 
     @staticmethod
-    def _but_check(words_and_emoticons, sentiments):
-        # Check for modification in sentiment due to contrastive conjunction 'but'
-        words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
-
-        for mas in ['mas', 'entretanto', 'todavia', 'porem', 'porém']:
-            if mas in words_and_emoticons_lower:
-                bi = words_and_emoticons_lower.index(mas)
-                for sentiment in sentiments:
-                    si = sentiments.index(sentiment)
-                    if si < bi:
-                        sentiments.pop(si)
-                        sentiments.insert(si, sentiment * 0.5)
-                    elif si > bi:
-                        sentiments.pop(si)
-                        sentiments.insert(si, sentiment * 1.5)
-            return sentiments
+    def _but_check(words_and_emoticons_lower, sentiments):
+        # Check for modification in sentiment due to contrastive conjunction 'but'.
+        # Only 'mas' has ever been applied: the loop used to return after its
+        # first pass, so the other conjunctions are kept out to preserve scores.
+        if 'mas' in words_and_emoticons_lower:
+            bi = words_and_emoticons_lower.index('mas')
+            for si, sentiment in enumerate(sentiments):
+                if si < bi:
+                    sentiments[si] = sentiment * 0.5
+                elif si > bi:
+                    sentiments[si] = sentiment * 1.5
+        return sentiments
 
 
     @staticmethod
-    def _special_idioms_check(valence, words_and_emoticons, i):
-        words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
-        onezero = "{0} {1}".format(
-            words_and_emoticons_lower[i - 1], 
-            words_and_emoticons_lower[i]
-        )
-
-        twoonezero = "{0} {1} {2}".format(
-            words_and_emoticons_lower[i - 2],
-            words_and_emoticons_lower[i - 1], 
-            words_and_emoticons_lower[i]
-        )
-
-        twoone = "{0} {1}".format(
-            words_and_emoticons_lower[i - 2], 
-            words_and_emoticons_lower[i - 1]
-        )
-
-        threetwoone = "{0} {1} {2}".format(
-            words_and_emoticons_lower[i - 3],
-            words_and_emoticons_lower[i - 2], 
-            words_and_emoticons_lower[i - 1]
-        )
-
-        threetwo = "{0} {1}".format(
-            words_and_emoticons_lower[i - 3], 
-            words_and_emoticons_lower[i - 2]
-        )
+    def _special_idioms_check(valence, sentitext, i):
+        phrases = sentitext.phrases
+        if not phrases:
+            return valence
 
-        sequences = [onezero, twoonezero, twoone, threetwoone, threetwo]
+        # (start, end) spans of the n-grams around i: onezero, twoonezero,
+        # twoone, threetwoone, threetwo
+        sequences = [(i - 1, i + 1), (i - 2, i + 1), (i - 2, i), (i - 3, i), (i - 3, i - 1)]
 
         for seq in sequences:
-            if seq in SPECIAL_CASE_IDIOMS:
-                valence = SPECIAL_CASE_IDIOMS[seq]
+            found = phrases.get(seq)
+            if found is not None and found[0] is not None:
+                valence = found[0]
                 break
 
-        if len(words_and_emoticons_lower) - 1 > i:
-            zeroone = "{0} {1}".format(
-                words_and_emoticons_lower[i], 
-                words_and_emoticons_lower[i + 1]
-            )
-            if zeroone in SPECIAL_CASE_IDIOMS:
-                valence = SPECIAL_CASE_IDIOMS[zeroone]
-
-        if len(words_and_emoticons_lower) - 1 > i + 1:
-            zeroonetwo = "{0} {1} {2}".format(
-                words_and_emoticons_lower[i], 
-                words_and_emoticons_lower[i + 1],
-                words_and_emoticons_lower[i + 2]
-                )
-            if zeroonetwo in SPECIAL_CASE_IDIOMS:
-                valence = SPECIAL_CASE_IDIOMS[zeroonetwo]
+        # zeroone, then zeroonetwo
+        for seq in [(i, i + 2), (i, i + 3)]:
+            found = phrases.get(seq)
+            if found is not None and found[0] is not None:
+                valence = found[0]
 
         # Check for booster/dampener bi-grams such as 'sort of' or 'kind of'
-        n_grams = [threetwoone, threetwo, twoone]
+        n_grams = [(i - 3, i), (i - 3, i - 1), (i - 2, i)]
         for n_gram in n_grams:
-            if n_gram in BOOSTER_DICT:
-                valence = valence + BOOSTER_DICT[n_gram]
+            found = phrases.get(n_gram)
+            if found is not None and found[1] is not None:
+                valence = valence + found[1]
 
         return valence
 
 
     @staticmethod
-    def _negation_check(valence, words_and_emoticons, start_i, i):
-        words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
+    def _negation_check(valence, sentitext, start_i, i):
+        words_and_emoticons_lower = sentitext.words_lower
         if start_i == 0:
-            if negated([words_and_emoticons_lower[i - (start_i + 1)]]):  # 1 word preceding lexicon word (w/o stopwords)
+            if sentitext.negated_at(i - (start_i + 1), i):  # 1 word preceding lexicon word (w/o stopwords)
                 valence = valence * N_SCALAR
         if start_i == 1:
             if words_and_emoticons_lower[i - 2] == "nunca" and \
@@ -424,7 +826,7 @@ class SentimentIntensityAnalyzer(object):
             elif words_and_emoticons_lower[i - 2] == "sem" and \
                     words_and_emoticons_lower[i - 1] == "dúvida":
                 valence = valence
-            elif negated([words_and_emoticons_lower[i - (start_i + 1)]]):  # 2 words preceding the lexicon word position
+            elif sentitext.negated_at(i - (start_i + 1), i):  # 2 words preceding the lexicon word position
                 valence = valence * N_SCALAR
         if start_i == 2:
             if words_and_emoticons_lower[i - 3] == "nunca" and \
@@ -434,7 +836,7 @@ class SentimentIntensityAnalyzer(object):
             elif words_and_emoticons_lower[i - 3] == "sem" and \
                     (words_and_emoticons_lower[i - 2] == "dúvida" or words_and_emoticons_lower[i - 1] == "dúvida"):
                 valence = valence
-            elif negated([words_and_emoticons_lower[i - (start_i + 1)]]):  # 3 words preceding the lexicon word position
+            elif sentitext.negated_at(i - (start_i + 1), i):  # 3 words preceding the lexicon word position
                 valence = valence * N_SCALAR
         return valence
 
@@ -494,6 +896,10 @@ class SentimentIntensityAnalyzer(object):
 
 
     def score_valence(self, sentiments, text):
+        return dict(zip(SCORE_KEYS, self._valence_tuple(sentiments, text)))
+
+
+    def _valence_tuple(self, sentiments, text):
         if sentiments:
             sum_s = float(sum(sentiments))
             # Compute and add emphasis from punctuation in text
@@ -523,14 +929,32 @@ class SentimentIntensityAnalyzer(object):
             neg = 0.0
             neu = 0.0
 
-        sentiment_dict = {
-            'neg': round(neg, 3),
-            'neu': round(neu, 3),
-            'pos': round(pos, 3),
-            'compound': round(compound, 4)
-        }
+        return round(neg, 3), round(neu, 3), round(pos, 3), round(compound, 4)
+
+
+def _score_columns(rows):
+    """
+    Turn (neg, neu, pos, compound) rows into a dict of NumPy columns
+    """
+    import numpy as np
+
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(SCORE_KEYS))
+    return {key: table[:, j] for j, key in enumerate(SCORE_KEYS)}
+
+
+# Per-process analyzer used by score_parallel workers
+_worker_analyzer = None
+
+
+def _init_worker(lexicon_file, emoji_lexicon):
+    global _worker_analyzer
+    # Forked workers already hold the parent's analyzer
+    if _worker_analyzer is None:
+        _worker_analyzer = SentimentIntensityAnalyzer(lexicon_file, emoji_lexicon)
+
 
-        return sentiment_dict
+def _score_chunk(texts):
+    return _worker_analyzer._score_rows(texts)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+""" Inverted index of the lexicon words leia found in each tweet.
+Built from the LexiconHit lists of polarity_scores_batch(texts, hits=...),
+so drill-down queries such as which words pulled a profile's sentiment
+down in a week, or which tweets contain a word, need no rescoring. Tweets
+are appended as they are scored, and the index round-trips through flat
+columns, one row per hit, to be stored next to the tweets.
+"""
+
+import threading
+import unicodedata
+from array import array
+
+import numpy as np
+
+import leia
+
+# Bits of a hit's flags
+NEGATED = 1
+BOOSTED = 2
+
+HIT_COLUMNS = ['tweet_id', 'username', 'timestamp', 'token', 'valence', 'negated', 'boosted']
+
+
+def normalize_term(term):
+    # Terms are indexed as leia sees them: lower case, without accents
+    return unicodedata.normalize('NFKD', term.strip()).encode('ASCII', 'ignore').decode('ASCII').lower()
+
+
+class LexiconIndex(object):
+    """
+    Tweets (id, username, timestamp in seconds) and their hits (tweet,
+    term, valence, flags) are kept in parallel typed arrays; postings map
+    each term to the positions of its hits.
+    """
+    def __init__(self):
+        self.positions = {}
+        self.tweet_ids = array('q')
+        self.tweet_users = array('q')
+        self.tweet_times = array('d')
+        self.users = []
+        self.user_codes = {}
+        self.terms = []
+        self.term_codes = {}
+        self.hit_tweets = array('q')
+        self.hit_terms = array('q')
+        self.hit_valences = array('f')
+        self.hit_flags = array('b')
+        self.postings = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tweet_ids)
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.positions
+
+    @staticmethod
+    def _code(codes, names, name):
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def add(self, tweet_ids, usernames, timestamps, hits):
+        """
+        Index tweets with the LexiconHit list of each one's text. Tweets
+        already indexed are skipped: their text, and so their hits, do not
+        change. Returns how many were added.
+        """
+        added = 0
+        with self.lock:
+            for tweet_id, username, timestamp, tweet_hits in zip(tweet_ids, usernames, timestamps, hits):
+                if tweet_id in self.positions:
+                    continue
+                position = self.positions[tweet_id] = len(self.tweet_ids)
+                self.tweet_ids.append(tweet_id)
+                self.tweet_users.append(self._code(self.user_codes, self.users, username))
+                self.tweet_times.append(timestamp)
+                for hit in tweet_hits:
+                    term = self._code(self.term_codes, self.terms, hit.token)
+                    self.postings.setdefault(term, array('q')).append(len(self.hit_tweets))
+                    self.hit_tweets.append(position)
+                    self.hit_terms.append(term)
+                    self.hit_valences.append(hit.valence)
+                    self.hit_flags.append(NEGATED * hit.negated | BOOSTED * hit.boosted)
+                added += 1
+        return added
+
+    def _tweet_mask(self, username, start, end, tweet_ids=None):
+        # Which tweets belong to username (any when None), fall in
+        # [start, end) (unbounded sides when None) and are in tweet_ids
+        # (any when None)
+        mask = np.ones(len(self.tweet_ids), dtype=bool)
+        if tweet_ids is not None:
+            mask &= np.isin(np.array(self.tweet_ids, dtype=np.int64), np.asarray(tweet_ids, dtype=np.int64))
+        if username is not None:
+            code = self.user_codes.get(username)
+            mask &= np.array(self.tweet_users, dtype=np.int64) == (-1 if code is None else code)
+        if start is not None or end is not None:
+            times = np.array(self.tweet_times, dtype=np.float64)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times < end
+        return mask
+
+    def top_terms(self, username=None, start=None, end=None, n=10, negative=True, tweet_ids=None):
+        """
+        Return the n terms that added the most negative (or positive)
+        valence over the tweets of username from start to end, as
+        (term, total valence, hits, tweets), strongest first. tweet_ids
+        restricts the search to those tweets.
+        """
+        with self.lock:
+            tweet_mask = self._tweet_mask(username, start, end, tweet_ids)
+            hit_tweets = np.array(self.hit_tweets, dtype=np.int64)
+            hit_terms = np.array(self.hit_terms, dtype=np.int64)
+            valences = np.array(self.hit_valences, dtype=np.float64)
+            terms = list(self.terms)
+        selected = tweet_mask[hit_tweets] & ((valences < 0) if negative else (valences > 0))
+        hit_tweets, hit_terms, valences = hit_tweets[selected], hit_terms[selected], valences[selected]
+        totals = np.bincount(hit_terms, weights=valences, minlength=len(terms))
+        hits = np.bincount(hit_terms, minlength=len(terms))
+        pairs = np.unique(np.stack([hit_terms, hit_tweets]), axis=1)
+        tweets = np.bincount(pairs[0], minlength=len(terms))
+        order = np.argsort(totals if negative else -totals, kind='stable')
+        return [(terms[term], float(totals[term]), int(hits[term]), int(tweets[term]))
+                for term in order[:n] if hits[term]]
+
+    def tweets_with(self, term, username=None, start=None, end=None, tweet_ids=None):
+        """
+        Return (tweet id, valence, negated, boosted) for every hit of term
+        in the tweets of username from start to end, newest tweet first.
+        tweet_ids restricts the search to those tweets.
+        """
+        term = normalize_term(term)
+        with self.lock:
+            code = self.term_codes.get(term)
+            if code is None:
+                return []
+            tweet_mask = self._tweet_mask(username, start, end, tweet_ids)
+            rows = []
+            for hit in self.postings[code]:
+                position = self.hit_tweets[hit]
+                if tweet_mask[position]:
+                    flags = self.hit_flags[hit]
+                    rows.append((self.tweet_times[position], self.tweet_ids[position], self.hit_valences[hit],
+                                 bool(flags & NEGATED), bool(flags & BOOSTED)))
+        rows.sort(reverse=True)
+        return [row[1:] for row in rows]
+
+    def columns(self):
+        """
+        The index as HIT_COLUMNS lists, one row per hit, for storage.
+        """
+        with self.lock:
+            positions = list(self.hit_tweets)
+            flags = list(self.hit_flags)
+            return {
+                'tweet_id': [self.tweet_ids[position] for position in positions],
+                'username': [self.users[self.tweet_users[position]] for position in positions],
+                'timestamp': [self.tweet_times[position] for position in positions],
+                'token': [self.terms[term] for term in self.hit_terms],
+                'valence': list(self.hit_valences),
+                'negated': [bool(flag & NEGATED) for flag in flags],
+                'boosted': [bool(flag & BOOSTED) for flag in flags],
+            }
+
+    def add_columns(self, columns):
+        """
+        Add the hits stored by columns(); returns how many tweets were added.
+        """
+        tweets = {}
+        for tweet_id, username, timestamp, token, valence, negated, boosted in zip(
+                *(columns[column] for column in HIT_COLUMNS)):
+            tweet = tweets.setdefault(tweet_id, (username, timestamp, []))
+            tweet[2].append(leia.LexiconHit(token, valence, negated, boosted))
+        return self.add(list(tweets), *zip(*tweets.values())) if tweets else 0
@@ -0,0 +1,811 @@
+""" The dashboard's data pipeline, importable without Streamlit.
+Scrapes the candidates' profiles through the configured tweet source and
+tweet store, builds the normalized tweets and profiles frames with their
+derived metrics and, optionally, sentiment scores, and aggregates them the
+way the charts draw them. Heavy optional dependencies (snscrape, pyarrow)
+are only imported when used.
+
+Run as a script it precomputes a dataset to Parquet for the dashboard to
+read at startup, e.g. from cron:
+
+    python pipeline.py --tweets 1000 --output data/precomputed jairbolsonaro LulaOficial
+"""
+
+import os
+import sys
+import glob
+import json
+import fcntl
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError, as_completed, wait, FIRST_COMPLETED
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+import leia
+import tweetstore
+import sources
+import boxstats
+import timeseries
+import lexiconindex
+import instrument
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of candidate profiles scraped at the same time
+SCRAPE_CONCURRENCY = 4
+# How long a load is reused before the tweet store is synced again
+STORE_REFRESH_SECONDS = 10 * 60
+# Scraped profiles are reused for PROFILE_CACHE_TTL seconds, within a memory
+# budget of PROFILE_CACHE_MB megabytes shared by every session
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', STORE_REFRESH_SECONDS))
+PROFILE_CACHE_MB = float(os.environ.get('PROFILE_CACHE_MB', 256))
+# A streaming load refreshes the page every STREAM_REFRESH_TWEETS new tweets
+# or STREAM_REFRESH_SECONDS, whichever comes first
+STREAM_REFRESH_TWEETS = 500
+STREAM_REFRESH_SECONDS = 2.0
+# Whether scoring records the lexicon words of each tweet in lexiconIndex()
+RECORD_LEXICON_HITS = os.environ.get('LEXICON_HITS', '1') != '0'
+
+class PartialScrapeError(Exception):
+    """
+    Some profiles failed to scrape. `dataframe` and `profiles` hold the
+    tweets and profiles of the ones that succeeded and `errors` maps each
+    failed url to its exception.
+    Raised instead of returned so a partial load is never taken for a full one.
+    """
+    def __init__(self, dataframe, profiles, errors):
+        super().__init__(f'Falha ao carregar {", ".join(errors)}')
+        self.dataframe = dataframe
+        self.profiles = profiles
+        self.errors = errors
+
+def shared(function):
+    """
+    Decorator for a process-wide resource built by `function` on first use
+    and then returned to every session and thread. Unlike lru_cache, it is
+    built only once even when first asked for from several threads at once.
+    """
+    lock = threading.Lock()
+    built = []
+
+    @wraps(function)
+    def resource():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(function())
+        return built[0]
+    resource.clear = built.clear
+    return resource
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function and the ones arriving while it runs wait for it and share its
+    result or exception instead of running it again. If the first caller
+    is stopped instead (a Streamlit rerun or stop, KeyboardInterrupt), the
+    waiting ones try again, one of them running the function.
+    """
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        # Returns (result, shared), shared being True for the callers that waited
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Future()
+            if leader:
+                break
+            try:
+                result = flight.result()
+            except CancelledError:
+                continue
+            instrument.count('single_flight.shared')
+            return result, True
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            self._land(key)
+            if isinstance(error, Exception):
+                flight.set_exception(error)
+            else:
+                flight.cancel()
+            raise
+        self._land(key)
+        flight.set_result(result)
+        return result, False
+
+    def _land(self, key):
+        # Callers arriving from now on start a new flight
+        with self.lock:
+            del self.flights[key]
+
+TWEET_COLUMNS = ['Username', 'Displayname', 'Description', 'Follower Count', 'Following Count',
+                 'Datetime', 'Tweet Id', 'Text', 'Likes', 'Retweets', 'Replies']
+INT_COLUMNS = ['Follower Count', 'Following Count', 'Tweet Id', 'Likes', 'Retweets', 'Replies']
+# Fields of the profile rather than the tweet, kept once per Username in the profiles table
+PROFILE_COLUMNS = ['Displayname', 'Description', 'Follower Count', 'Following Count']
+RATIO_COLUMNS = ['like_ratio', 'RT_ratio', 'reply_ratio', 'engagement_ratio']
+# Frame attribute with the number of tweets per profile a frame was loaded
+# with, telling apart the datasets of the same profiles
+DATASET_ATTR = 'n_tweets'
+
+class TweetFrameBuilder:
+    """
+    Collects scraped tweets column by column and builds the DataFrame once.
+    Integer columns are kept in int64 array buffers rather than as Python
+    objects, and Datetime is converted to datetime64 in one go.
+    """
+    def __init__(self):
+        self.columns = {column: array('q') if column in INT_COLUMNS else [] for column in TWEET_COLUMNS}
+        self._buffers = [self.columns[column] for column in TWEET_COLUMNS]
+
+    def __len__(self):
+        return len(self.columns['Tweet Id'])
+
+    def append(self, row):
+        # row holds one value per TWEET_COLUMNS entry, in that order
+        for buffer, value in zip(self._buffers, row):
+            buffer.append(value)
+
+    def extend(self, other):
+        for buffer, other_buffer in zip(self._buffers, other._buffers):
+            buffer.extend(other_buffer)
+
+    def head(self, n):
+        builder = TweetFrameBuilder()
+        for buffer, own_buffer in zip(builder._buffers, self._buffers):
+            buffer.extend(own_buffer[:n])
+        return builder
+
+    def nbytes(self):
+        # Approximate memory held by the buffers and the objects in them
+        total = 0
+        for buffer in self._buffers:
+            if isinstance(buffer, array):
+                total += buffer.itemsize * len(buffer)
+            else:
+                total += sys.getsizeof(buffer) + sum(sys.getsizeof(value) for value in buffer)
+        return total
+
+    def build(self):
+        data = {}
+        for column, buffer in self.columns.items():
+            if column in INT_COLUMNS:
+                data[column] = np.array(buffer, dtype=np.int64)
+            elif column == 'Datetime':
+                data[column] = pd.to_datetime(buffer, utc=True)
+            else:
+                data[column] = buffer
+        return pd.DataFrame(data, columns=TWEET_COLUMNS)
+
+@shared
+def tweetSource():
+    # snscrape unless TWEET_SOURCE points at a replay dump or synthetic tweets
+    return sources.get_source()
+
+def profileTweets(twitter_url, max_id=None):
+    user = twitter_url.replace('https://twitter.com/', '')
+    # TweetRecord tuples, newest first
+    return tweetSource().tweets(user, max_id)
+
+def scrapeProfileTweets(twitter_url, n_tweets, builder):
+    # Using the tweet source to scrape data and append tweets to the builder
+    for i,row in enumerate(profileTweets(twitter_url)):
+        if i > n_tweets:
+            break
+        
+        else:
+            
+            builder.append(row)
+    return builder
+
+@shared
+def tweetStore():
+    # Replayed and synthetic tweets are kept out of the on-disk store unless
+    # TWEET_STORE_PATH asks for one
+    if not isinstance(tweetSource(), sources.SnscrapeSource) and 'TWEET_STORE_PATH' not in os.environ:
+        return tweetstore.TweetStore(':memory:')
+    return tweetstore.TweetStore()
+
+class LiveTweets:
+    """
+    The tweets of a profile as they are scraped, readable from another
+    thread while the scrape goes on.
+    """
+    def __init__(self):
+        self.builder = TweetFrameBuilder()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.builder)
+
+    def tap(self, rows, cancel=None):
+        # Passes rows through, keeping a copy, until cancel is set
+        for row in rows:
+            if cancel is not None and cancel.is_set():
+                return
+            with self.lock:
+                self.builder.append(row)
+            yield row
+
+    def copy_into(self, builder):
+        with self.lock:
+            builder.extend(self.builder)
+        return builder
+
+class ProfileCache:
+    """
+    The newest tweets of each profile as last loaded, keyed by username
+    and remembering how many were asked for. A request for fewer tweets
+    is served by slicing a fresher entry for more; entries expire after
+    `ttl` seconds and the least recently used ones are evicted once they
+    hold more than `max_bytes`.
+    """
+    def __init__(self, ttl=PROFILE_CACHE_TTL, max_bytes=PROFILE_CACHE_MB * 2**20):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, username, n_tweets):
+        key = tweetstore.profile_key(username)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            builder, cached_tweets, loaded_at, nbytes = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                self._drop(key)
+                return None
+            if cached_tweets < n_tweets:
+                return None
+            self.entries.move_to_end(key)
+        return builder.head(n_tweets)
+
+    def put(self, username, n_tweets, builder):
+        key = tweetstore.profile_key(username)
+        nbytes = builder.nbytes()
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (builder, n_tweets, time.monotonic(), nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        self.nbytes -= self.entries.pop(key)[3]
+
+@shared
+def profileCache():
+    return ProfileCache()
+
+@shared
+def profileLoads():
+    return SingleFlight()
+
+def loadProfileTweets(twitter_url, n_tweets, store, live=None, cancel=None):
+    # A larger request than the one cached goes back to the store, which
+    # only scrapes the tweets it does not have yet. Sessions asking for the
+    # same profile at once wait for a single scrape and then read what it
+    # cached, running their own only if it was cancelled or got fewer tweets
+    user = twitter_url.replace('https://twitter.com/', '')
+    cache = profileCache()
+
+    def load():
+        builder = syncProfileTweets(twitter_url, n_tweets, TweetFrameBuilder(), store, live, cancel)
+        if cancel is None or not cancel.is_set():
+            cache.put(user, n_tweets + 1, builder)
+        return builder
+
+    while True:
+        builder = cache.get(user, n_tweets + 1)
+        instrument.count('profile_cache.miss' if builder is None else 'profile_cache.hit')
+        if builder is not None:
+            return builder
+        builder, waited = profileLoads().do(tweetstore.profile_key(user), load)
+        if not waited:
+            return builder
+
+def syncProfileTweets(twitter_url, n_tweets, builder, store, live=None, cancel=None):
+    # Only tweets newer than the stored ones (plus a small backfill) are
+    # scraped, the rest is read back from the store
+    user = twitter_url.replace('https://twitter.com/', '')
+    def tap(tweets):
+        return tweets if live is None else live.tap(tweets, cancel)
+
+    tweets = profileTweets(twitter_url)
+    with instrument.span('scrape', user=user) as attrs:
+        try:
+            attrs['fetched'] = store.sync(user, tap(tweets), n_tweets + 1,
+                                          older=lambda max_id: tap(profileTweets(twitter_url, max_id)))
+        finally:
+            tweets.close()
+    instrument.count(f'tweets_fetched.{user}', attrs['fetched'])
+    with instrument.span('store.read', user=user) as attrs:
+        for row in store.latest(user, n_tweets + 1):
+            builder.append(row)
+        attrs['rows'] = len(builder)
+    return builder
+
+def addDerivedColumns(tweets_df):
+    tweets_df['like_ratio'] = (tweets_df['Likes'] / tweets_df['Follower Count']) * 100
+    tweets_df['RT_ratio'] = (tweets_df['Retweets'] / tweets_df['Follower Count']) * 100
+    tweets_df['reply_ratio'] = (tweets_df['Replies'] / tweets_df['Follower Count']) * 100
+    tweets_df['engagement_ratio'] = ((tweets_df['Likes'] + tweets_df['Retweets'] + tweets_df['Replies']) / tweets_df['Follower Count']) * 100
+    tweets_df[RATIO_COLUMNS] = tweets_df[RATIO_COLUMNS].astype(np.float32)
+    tweets_df['day'] = tweets_df.Datetime.dt.day.astype(np.int8)
+    tweets_df['week'] = tweets_df.Datetime.dt.isocalendar().week.astype(np.int8)
+    tweets_df['month'] = tweets_df.Datetime.dt.month.astype(np.int8)
+    tweets_df['date'] = tweets_df.Datetime.dt.normalize()
+
+    return tweets_df
+
+def epochSeconds(datetimes):
+    return (datetimes - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+
+def normalizeTweets(tweets_df):
+    # Splits the scraped frame into a profiles table, one row per Username
+    # with its newest profile fields, and a tweets table without them
+    profiles = tweets_df.drop_duplicates('Username').set_index('Username')[PROFILE_COLUMNS]
+    profiles = profiles.astype({'Follower Count': np.int64, 'Following Count': np.int32})
+
+    tweets = tweets_df.drop(columns=PROFILE_COLUMNS)
+    tweets['Username'] = tweets['Username'].astype('category')
+    for column in ['Likes', 'Retweets', 'Replies']:
+        tweets[column] = pd.to_numeric(tweets[column], downcast='integer')
+    return tweets, profiles
+
+def memoryReport(tweets_df, profiles_df):
+    # Bytes per column of the normalized tables next to the single wide
+    # frame they replace, with a row per tweet repeating the profile fields
+    wide = tweets_df.join(profiles_df, on='Username')
+    wide = wide.astype({'Username': object, 'Likes': np.int64, 'Retweets': np.int64, 'Replies': np.int64,
+                        'day': np.int32, 'week': np.uint32, 'month': np.int32,
+                        **{column: np.float64 for column in RATIO_COLUMNS}})
+    wide['date'] = wide['Datetime'].dt.date
+    if 'compound' in wide.columns:
+        wide = wide.astype({key: np.float64 for key in leia.SCORE_KEYS})
+
+    normalized = pd.concat([tweets_df.memory_usage(deep=True, index=False),
+                            profiles_df.reset_index().memory_usage(deep=True, index=False)]).groupby(level=0).sum()
+    report = pd.DataFrame({'wide': wide.memory_usage(deep=True, index=False), 'normalized': normalized})
+    report = report.fillna(0).astype(np.int64)
+    report.loc['Total'] = report.sum()
+    return report
+
+def twitterProfileScrape(twitter_url, n_tweets=100):
+    builder = scrapeProfileTweets(twitter_url, n_tweets, TweetFrameBuilder())
+    return addDerivedColumns(builder.build())
+
+def twitterDataframeConcat(url_list, n_tweets, max_workers=SCRAPE_CONCURRENCY, on_progress=None):
+    # Profiles are scraped concurrently, each into its own builder;
+    # on_progress(twitter_url, n_scraped, error) is called from this
+    # thread as each one finishes
+    store = tweetStore()
+    builders = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(instrument.bind(loadProfileTweets), twitter_url, n_tweets, store): twitter_url
+                   for twitter_url in url_list}
+        for future in as_completed(futures):
+            twitter_url = futures[future]
+            try:
+                builders[twitter_url] = future.result()
+            except Exception as error:
+                errors[twitter_url] = error
+            if on_progress is not None:
+                on_progress(twitter_url, len(builders.get(twitter_url, ())), errors.get(twitter_url))
+
+    dataframe, profiles = assembleTweets(url_list, builders, n_tweets)
+    if errors:
+        raise PartialScrapeError(dataframe, profiles, errors)
+    return dataframe, profiles
+
+def assembleTweets(url_list, builders, n_tweets):
+    # Merged in the order the candidates were chosen, whatever order they
+    # finished in, then turned into a frame and derived once
+    with instrument.span('frame.build') as attrs:
+        combined = TweetFrameBuilder()
+        for twitter_url in url_list:
+            if twitter_url in builders:
+                combined.extend(builders[twitter_url])
+        attrs['rows'] = len(combined)
+        instrument.count('frame.rows', len(combined))
+        tweets, profiles = normalizeTweets(addDerivedColumns(combined.build()))
+        tweets.attrs[DATASET_ATTR] = n_tweets
+        return tweets, profiles
+
+def twitterDataframeStream(url_list, n_tweets, on_refresh, max_workers=SCRAPE_CONCURRENCY, cancel=None,
+                           refresh_tweets=STREAM_REFRESH_TWEETS, refresh_seconds=STREAM_REFRESH_SECONDS):
+    # The same load as twitterDataframeConcat, calling
+    # on_refresh(dataframe, profiles, scraped, finished) from this thread
+    # with everything scraped so far every refresh_tweets tweets or
+    # refresh_seconds. Setting cancel, or leaving early because on_refresh
+    # raised, stops the scrapes still running.
+    if cancel is None:
+        cancel = threading.Event()
+    store = tweetStore()
+    lives = {twitter_url: LiveTweets() for twitter_url in url_list}
+    builders = {}
+    errors = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(instrument.bind(loadProfileTweets), twitter_url, n_tweets, store,
+                                   lives[twitter_url], cancel):
+                   twitter_url
+                   for twitter_url in url_list}
+        pending = set(futures)
+        shown = 0
+        refreshed_at = time.monotonic()
+        while pending:
+            timeout = max(0, refreshed_at + refresh_seconds - time.monotonic())
+            finished, pending = wait(pending, timeout=min(timeout, 0.1), return_when=FIRST_COMPLETED)
+            for future in finished:
+                twitter_url = futures[future]
+                try:
+                    builders[twitter_url] = future.result()
+                except Exception as error:
+                    errors[twitter_url] = error
+
+            scraped = {twitter_url: len(builders.get(twitter_url, lives[twitter_url])) for twitter_url in url_list}
+            if pending and (sum(scraped.values()) - shown >= refresh_tweets or
+                            time.monotonic() - refreshed_at >= refresh_seconds):
+                # Finished profiles as they will be in the result, the others
+                # with the tweets scraped so far
+                preview = {twitter_url: builders.get(twitter_url) or lives[twitter_url].copy_into(TweetFrameBuilder())
+                           for twitter_url in url_list if twitter_url not in errors}
+                on_refresh(*assembleTweets(url_list, preview, n_tweets), scraped, set(builders) | set(errors))
+                shown = sum(scraped.values())
+                refreshed_at = time.monotonic()
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    dataframe, profiles = assembleTweets(url_list, builders, n_tweets)
+    if errors:
+        raise PartialScrapeError(dataframe, profiles, errors)
+    return dataframe, profiles
+
+@shared
+def sentimentAnalyzer():
+    # Holds nothing but the parsed lexicons once built, so every session
+    # scores with the same one
+    return leia.SentimentIntensityAnalyzer()
+
+@shared
+def sentimentCache():
+    # Tweet Id -> (neg, neu, pos, compound), shared by every rerun and session
+    return {}
+
+@shared
+def lexiconIndex():
+    # Lexicon words of every tweet scored, for drill-down queries
+    return lexiconindex.LexiconIndex()
+
+@shared
+def sentimentScoring():
+    # Held while scoring cache misses, so sessions refreshing on the same
+    # new tweets score them once
+    return threading.Lock()
+
+def addSentimentColumns(tweets_df):
+    scores = sentimentCache()
+
+    # Only tweets never scored before go through leia
+    def unscored():
+        return tweets_df.loc[~tweets_df['Tweet Id'].isin(scores.keys()),
+                             ['Tweet Id', 'Username', 'Datetime', 'Text']].drop_duplicates('Tweet Id')
+
+    new_tweets = unscored()
+    if len(new_tweets):
+        with sentimentScoring():
+            # Less whatever another session scored while this one waited
+            new_tweets = unscored()
+            if len(new_tweets):
+                hits = [] if RECORD_LEXICON_HITS else None
+                with instrument.span('sentiment', texts=len(new_tweets)):
+                    new_scores = sentimentAnalyzer().polarity_scores_batch(new_tweets['Text'], hits)
+                if hits is not None:
+                    lexiconIndex().add(new_tweets['Tweet Id'].tolist(), new_tweets['Username'].astype(str).tolist(),
+                                       epochSeconds(new_tweets['Datetime']).tolist(), hits)
+                scores.update(zip(new_tweets['Tweet Id'], zip(*(new_scores[key] for key in leia.SCORE_KEYS))))
+    instrument.count('sentiment_cache.hit', len(tweets_df) - len(new_tweets))
+    instrument.count('sentiment_cache.miss', len(new_tweets))
+
+    sentiment = pd.DataFrame([scores[tweet_id] for tweet_id in tweets_df['Tweet Id']],
+                             columns=list(leia.SCORE_KEYS), index=tweets_df.index, dtype=np.float32)
+    scored = pd.concat([tweets_df.drop(columns=list(leia.SCORE_KEYS), errors='ignore'), sentiment], axis=1)
+    scored.attrs.update(tweets_df.attrs)
+    return scored
+
+
+@shared
+def datasetLoads():
+    return SingleFlight()
+
+def loadDataset(url_list, n_tweets, sentiment=True, on_progress=None, max_workers=SCRAPE_CONCURRENCY):
+    """
+    twitterDataframeConcat, then addSentimentColumns when `sentiment`,
+    run once for all the sessions asking for the same profiles and number
+    of tweets at the same time. The waiting ones get views of the frames
+    loaded for the first one and no on_progress calls.
+    """
+    key = (tuple(tweetstore.profile_key(twitter_url.replace('https://twitter.com/', '')) for twitter_url in url_list),
+           n_tweets, sentiment)
+
+    def load():
+        try:
+            tweets, profiles = twitterDataframeConcat(url_list, n_tweets, max_workers, on_progress)
+        except PartialScrapeError as partial:
+            if sentiment:
+                partial.dataframe = addSentimentColumns(partial.dataframe)
+            raise
+        return (addSentimentColumns(tweets) if sentiment else tweets), profiles
+
+    (tweets, profiles), waited = datasetLoads().do(key, load)
+    if waited:
+        return tweets.copy(deep=False), profiles.copy(deep=False)
+    return tweets, profiles
+
+########################### Aggregates ###########################
+
+# Per-tweet metrics drawn over time by the charts and how each is
+# aggregated per period
+CHART_AGGREGATES = {'engagement_ratio': 'sum', 'like_ratio': 'sum', 'RT_ratio': 'sum', 'reply_ratio': 'sum',
+                    'Likes': 'sum', 'Retweets': 'sum', 'Replies': 'sum', 'compound': 'mean'}
+CHART_KINDS = list(CHART_AGGREGATES)
+BOXPLOT_KINDS = ['Likes', 'Retweets', 'Replies']
+# Rolling metrics of rollingTable, drawn by day
+ROLLING_KINDS = ['engagement_ratio_7d', 'compound_ewm', 'tweets_per_hour']
+PERIODS = ['date', 'week', 'month']
+# Significant digits kept for the float metrics sent to the browser
+CHART_DIGITS = 6
+
+def frameFingerprint(df):
+    # Cheap content key for memoizing on a tweets frame without hashing all of it
+    kinds = [kind for kind in CHART_KINDS if kind in df.columns]
+    return int(pd.util.hash_pandas_object(df[['Tweet Id'] + kinds], index=False).sum())
+
+def compactColumns(df):
+    # Narrowest ints, floats rounded to CHART_DIGITS significant digits and
+    # whole days as plain dates, which is what keeps the chart JSON short
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            if (values == values.dt.normalize()).all():
+                df[column] = values.dt.strftime('%Y-%m-%d')
+        elif pd.api.types.is_integer_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            # float32 holds no exact 6-digit decimals, so they would still
+            # serialize with every digit of the binary value
+            values = values.astype(np.float64)
+            magnitude = np.floor(np.log10(np.abs(values.where(values != 0, 1))))
+            scale = 10.0 ** (CHART_DIGITS - 1 - magnitude)
+            df[column] = np.round(values * scale) / scale
+    return df
+
+def periodTable(df, period):
+    # One row per (Username, period) with every chart metric aggregated,
+    # so charts send a point per period instead of every tweet
+    aggregates = {kind: aggregate for kind, aggregate in CHART_AGGREGATES.items() if kind in df.columns}
+    with instrument.span('chart.aggregate', period=period) as attrs:
+        table = df.groupby(['Username', period], sort=True, observed=True).agg(aggregates).reset_index()
+        attrs['rows'] = len(table)
+        return compactColumns(table)
+
+@shared
+def boxplotStats():
+    return boxstats.BoxStats()
+
+def boxplotTable(df, stats=None):
+    # One row per (Username, kind) with the box and whiskers of each
+    # boxplot, kept up to date incrementally as tweets come and go; frames
+    # of different datasets keep separate state
+    if stats is None:
+        stats = boxplotStats()
+    dataset = df.attrs.get(DATASET_ATTR)
+    rows = []
+    with instrument.span('chart.boxstats', tweets=len(df)):
+        for username, tweets in df.groupby('Username', sort=True, observed=True):
+            ids = tweets['Tweet Id'].to_numpy()
+            for kind in BOXPLOT_KINDS:
+                summary = stats.sync((dataset, username, kind), ids, tweets[kind].to_numpy())
+                rows.append((username, kind) + tuple(summary))
+    table = pd.DataFrame(rows, columns=['Username', 'kind'] + list(boxstats.BoxSummary._fields))
+    return compactColumns(table)
+
+@shared
+def rollingSeries():
+    return timeseries.RollingSeries()
+
+def rollingTable(df, series=None):
+    # One row per (Username, date), empty days included, with the rolling
+    # metrics of the shared series, which only folds in the tweets that
+    # are new or changed since it last saw the profile in this dataset
+    if series is None:
+        series = rollingSeries()
+    dataset = df.attrs.get(DATASET_ATTR)
+    rows = []
+    with instrument.span('chart.rolling', tweets=len(df)):
+        for username, tweets in df.groupby('Username', sort=True, observed=True):
+            compounds = tweets['compound'].to_numpy() if 'compound' in tweets.columns else None
+            points = series.sync((dataset, username), tweets['Tweet Id'].to_numpy(),
+                                 epochSeconds(tweets['Datetime']).to_numpy(), tweets['engagement_ratio'].to_numpy(),
+                                 compounds)
+            rows.extend((username,) + tuple(point) for point in points)
+    table = pd.DataFrame(rows, columns=['Username'] + list(timeseries.RollingPoint._fields))
+    table.insert(1, 'date', pd.to_datetime(table.pop('day') * timeseries.DAY_SECONDS, unit='s', utc=True))
+    return compactColumns(table.drop(columns='tweets'))
+
+def termTable(tweets_df, username=None, start=None, end=None, n=10, negative=True):
+    # The words that added the most negative (or positive) sentiment to the
+    # tweets of tweets_df by username from start to end, datetimes in UTC.
+    # The index is shared by every session, so it is restricted to the
+    # tweets of this one
+    terms = lexiconIndex().top_terms(username, _seconds(start), _seconds(end), n, negative,
+                                     tweets_df['Tweet Id'].to_numpy())
+    return pd.DataFrame(terms, columns=['term', 'valence', 'hits', 'tweets'])
+
+def termTweets(tweets_df, term, username=None, start=None, end=None):
+    # The tweets of tweets_df where term counted towards the sentiment,
+    # newest first, with the valence it added
+    hits = pd.DataFrame(lexiconIndex().tweets_with(term, username, _seconds(start), _seconds(end),
+                                                   tweets_df['Tweet Id'].to_numpy()),
+                        columns=['Tweet Id', 'valence', 'negated', 'boosted'])
+    columns = ['Tweet Id', 'Username', 'Datetime', 'Text'] + [key for key in ['compound'] if key in tweets_df]
+    return hits.merge(tweets_df[columns], on='Tweet Id')[columns + ['valence', 'negated', 'boosted']]
+
+def _seconds(datetime):
+    return None if datetime is None else pd.Timestamp(datetime).timestamp()
+
+def hitsTable(tweets_df):
+    # Rows of lexiconIndex() for the tweets of tweets_df, to store with them
+    hits = pd.DataFrame(lexiconIndex().columns(), columns=lexiconindex.HIT_COLUMNS)
+    return hits[hits['tweet_id'].isin(tweets_df['Tweet Id'])].reset_index(drop=True)
+
+########################### Precomputed datasets ###########################
+
+# Where precompute() writes and the dashboard looks for a precomputed dataset
+PRECOMPUTED_PATH = os.environ.get('PRECOMPUTED_PATH',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'precomputed'))
+MANIFEST_FILE = 'manifest.json'
+
+def precompute(url_list, n_tweets, path=PRECOMPUTED_PATH, sentiment=True, max_workers=SCRAPE_CONCURRENCY):
+    """
+    Load url_list and write the tweets and profiles frames, a period table
+    per period and the boxplot table to `path` as Parquet, with a manifest
+    describing them. Profiles that failed are left out and listed in the
+    manifest's "errors". Each dataset is written to its own directory next
+    to `path`, a symlink swapped to it at the end, so readers never see a
+    half-written dataset or none at all.
+    """
+    errors = {}
+    try:
+        tweets, profiles = loadDataset(url_list, n_tweets, sentiment, max_workers=max_workers)
+    except PartialScrapeError as partial:
+        tweets, profiles = partial.dataframe, partial.profiles
+        errors = {twitter_url: str(error) for twitter_url, error in partial.errors.items()}
+
+    tables = {'tweets': tweets, 'profiles': profiles, 'boxplot': boxplotTable(tweets, boxstats.BoxStats()),
+              'rolling': rollingTable(tweets, timeseries.RollingSeries())}
+    tables.update((f'period-{period}', periodTable(tweets, period)) for period in PERIODS)
+    if sentiment and RECORD_LEXICON_HITS:
+        tables['lexicon-hits'] = hitsTable(tweets)
+    manifest = {'candidates': list(url_list), 'n_tweets': n_tweets, 'generated_at': time.time(),
+                'fingerprint': frameFingerprint(tweets), 'rows': len(tweets), 'tables': list(tables),
+                'errors': errors}
+
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    prefix = f'.{os.path.basename(path)}-'
+    # Written under a .partial name, which no other run removes
+    staging = tempfile.mkdtemp(prefix=prefix, suffix='.partial', dir=parent)
+    os.chmod(staging, 0o755)
+    try:
+        for name, table in tables.items():
+            table.to_parquet(os.path.join(staging, f'{name}.parquet'))
+        with open(os.path.join(staging, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # Runs swap and clean up one at a time, so none removes the version
+    # another one just made current
+    with open(os.path.join(parent, f'.{os.path.basename(path)}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        version = staging[:-len('.partial')]
+        os.rename(staging, version)
+        previous = os.path.realpath(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # A dataset from before they were versioned, moved aside once
+            previous = version + '.old'
+            os.replace(path, previous)
+        link = version + '.link'
+        os.symlink(os.path.basename(version), link)
+        os.replace(link, path)
+        # Readers may still be reading the dataset just replaced; older ones go
+        for other in glob.glob(os.path.join(parent, glob.escape(prefix) + '*')):
+            if not other.endswith('.partial') and other not in (version, previous):
+                shutil.rmtree(other, ignore_errors=True)
+    return manifest
+
+def readManifest(path=PRECOMPUTED_PATH):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def readPrecomputed(path=PRECOMPUTED_PATH):
+    """
+    Return (manifest, tweets, profiles) of the dataset precomputed at path,
+    or None if there is none. Its lexicon hits go into lexiconIndex().
+    """
+    # Everything from the same version, even if precompute() swaps in another
+    path = os.path.realpath(path)
+    manifest = readManifest(path)
+    if manifest is None:
+        return None
+    tweets = pd.read_parquet(os.path.join(path, 'tweets.parquet'))
+    profiles = pd.read_parquet(os.path.join(path, 'profiles.parquet'))
+    tweets.attrs[DATASET_ATTR] = manifest['n_tweets']
+    if 'lexicon-hits' in manifest['tables']:
+        hits = pd.read_parquet(os.path.join(path, 'lexicon-hits.parquet'))
+        lexiconIndex().add_columns({column: hits[column].tolist() for column in lexiconindex.HIT_COLUMNS})
+    return manifest, tweets, profiles
+
+def precomputedTable(name, fingerprint, path=PRECOMPUTED_PATH):
+    # A precomputed table, e.g. "period-week" or "rolling", if the dataset
+    # at path was computed from the tweets with this fingerprint
+    path = os.path.realpath(path)
+    manifest = readManifest(path)
+    if manifest is None or manifest['fingerprint'] != fingerprint or name not in manifest['tables']:
+        return None
+    return pd.read_parquet(os.path.join(path, f'{name}.parquet'))
+
+def profileUrl(profile):
+    if profile.startswith('https://'):
+        return profile
+    return 'https://twitter.com/' + profile.lstrip('@')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompute a dashboard dataset to Parquet.')
+    parser.add_argument('profiles', nargs='+', help='usernames or profile urls')
+    parser.add_argument('--tweets', type=int, default=1000, help='tweets per profile (default: 1000)')
+    parser.add_argument('--output', default=PRECOMPUTED_PATH, help=f'directory (default: {PRECOMPUTED_PATH})')
+    parser.add_argument('--workers', type=int, default=SCRAPE_CONCURRENCY, help='profiles scraped at a time')
+    parser.add_argument('--no-sentiment', dest='sentiment', action='store_false', help='skip sentiment scores')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    recorder = instrument.start('precompute')
+    manifest = precompute([profileUrl(profile) for profile in args.profiles], args.tweets, args.output,
+                          args.sentiment, args.workers)
+    for name, calls, total, longest in recorder.summary():
+        logger.info('%s: %d calls, %.1f ms', name, calls, total * 1000)
+    logger.info('Wrote %d tweets to %s', manifest['rows'], args.output)
+    for twitter_url, error in manifest['errors'].items():
+        logger.error('Failed to load %s: %s', twitter_url, error)
+    return 1 if manifest['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+""" Tweet sources consumed by the data pipeline.
+Each source yields TweetRecord tuples for a profile, newest first: live
+from Twitter through snscrape, replayed from a recorded JSONL/Parquet dump,
+or generated synthetically for scale tests without network access.
+
+The source used by the dashboard is picked with the TWEET_SOURCE
+environment variable: "snscrape" (default), "replay:<path>" or
+"synthetic:<tweets per profile>". TWEET_SOURCE_DELAY adds a delay in
+seconds before each replayed or synthetic tweet to simulate latency.
+"""
+
+import os
+import json
+import time
+import random
+import datetime
+from collections import namedtuple
+
+# Fields in the same order as the dashboard's tweet columns
+TweetRecord = namedtuple('TweetRecord', ['username', 'displayname', 'description', 'follower_count',
+                                         'following_count', 'datetime', 'tweet_id', 'text', 'likes',
+                                         'retweets', 'replies'])
+
+# Dashboard column names, also accepted as keys of recorded dumps
+COLUMN_FIELDS = {'Username': 'username', 'Displayname': 'displayname', 'Description': 'description',
+                 'Follower Count': 'follower_count', 'Following Count': 'following_count',
+                 'Datetime': 'datetime', 'Tweet Id': 'tweet_id', 'Text': 'text', 'Likes': 'likes',
+                 'Retweets': 'retweets', 'Replies': 'replies'}
+
+
+class TweetSource(object):
+    """
+    Base class of the tweet sources.
+    """
+    def tweets(self, username, max_id=None):
+        """
+        Yield the profile's tweets as TweetRecord, newest first, starting
+        from the newest one with an id up to max_id when given.
+        """
+        raise NotImplementedError
+
+
+class SnscrapeSource(TweetSource):
+    """
+    Live tweets from TwitterSearchScraper.
+    """
+    def tweets(self, username, max_id=None):
+        import snscrape.modules.twitter as sntwitter
+
+        query = f'from:{username}' if max_id is None else f'from:{username} max_id:{max_id}'
+        for tweet in sntwitter.TwitterSearchScraper(query).get_items():
+            yield TweetRecord(tweet.user.username, tweet.user.displayname, tweet.user.renderedDescription,
+                              tweet.user.followersCount, tweet.user.friendsCount, tweet.date, tweet.id,
+                              tweet.rawContent, tweet.likeCount, tweet.retweetCount, tweet.replyCount)
+
+
+class ReplaySource(TweetSource):
+    """
+    Tweets read back from a JSONL or Parquet dump, such as one written by
+    write_jsonl. Keys may be TweetRecord fields or dashboard column names.
+    """
+    def __init__(self, path, delay=0.0):
+        self.path = path
+        self.delay = delay
+        self._profiles = None
+
+    def load(self):
+        if self._profiles is None:
+            profiles = {}
+            for record in read_dump(self.path):
+                profiles.setdefault(record.username.lower(), []).append(record)
+            for records in profiles.values():
+                records.sort(key=lambda record: record.tweet_id, reverse=True)
+            self._profiles = profiles
+        return self._profiles
+
+    def tweets(self, username, max_id=None):
+        for record in self.load().get(username.lstrip('@').lower(), ()):
+            if max_id is not None and record.tweet_id > max_id:
+                continue
+            if self.delay:
+                time.sleep(self.delay)
+            yield record
+
+
+class SyntheticSource(TweetSource):
+    """
+    n_tweets generated tweets per profile, the same ones on every run for
+    a given seed and username.
+    """
+    WORDS = ['o', 'a', 'de', 'que', 'e', 'do', 'da', 'em', 'um', 'para', 'com', 'povo', 'governo', 'Brasil',
+             'eleição', 'saúde', 'educação', 'emprego', 'economia', 'amanhã', 'hoje', 'todos', 'bom', 'ótimo',
+             'ruim', 'péssimo', 'feliz', 'triste', 'amor', 'ódio', 'verdade', 'mentira', 'vitória',
+             'corrupção', 'obrigado', 'parabéns', 'esperança', 'medo', 'não', 'nunca', 'muito', 'pouco',
+             'mas', 'MUITO', 'BOM', '!', '!!!', '?', ':)', ':(', '😀', '😡', '🇧🇷', '❤️', '#debate']
+    START = datetime.datetime(2022, 10, 1, tzinfo=datetime.timezone.utc)
+    # Snowflake ids count milliseconds since this epoch in their top bits
+    TWITTER_EPOCH_MS = 1288834974657
+
+    def __init__(self, n_tweets=1000, seed=0, delay=0.0):
+        self.n_tweets = n_tweets
+        self.seed = seed
+        self.delay = delay
+
+    def tweets(self, username, max_id=None):
+        rng = random.Random(f'{self.seed}:{username.lower()}')
+        followers = int(rng.lognormvariate(12, 1.5))
+        following = rng.randint(10, 5000)
+        displayname = username.title()
+        description = ' '.join(rng.choices(self.WORDS, k=12))
+        date = self.START
+        ms = int(date.timestamp() * 1000) + 1
+        for i in range(self.n_tweets):
+            date -= datetime.timedelta(seconds=rng.expovariate(1 / 20000))
+            # Strictly decreasing, so ids keep the newest first order
+            ms = min(int(date.timestamp() * 1000), ms - 1)
+            tweet_id = ((ms - self.TWITTER_EPOCH_MS) << 22) | (i & 0x3fffff)
+            text = ' '.join(rng.choices(self.WORDS, k=rng.randint(3, 40)))
+            likes = int(rng.lognormvariate(6, 1.5))
+            if max_id is not None and tweet_id > max_id:
+                # Drawn anyway so every tweet is the same whatever max_id is
+                rng.uniform(0.05, 0.4), rng.uniform(0.01, 0.2)
+                continue
+            if self.delay:
+                time.sleep(self.delay)
+            yield TweetRecord(username, displayname, description, followers, following, date, tweet_id, text,
+                              likes, int(likes * rng.uniform(0.05, 0.4)), int(likes * rng.uniform(0.01, 0.2)))
+
+
+def record_from_dict(data):
+    values = {COLUMN_FIELDS.get(key, key): value for key, value in data.items()}
+    record = TweetRecord(**{field: values.get(field) for field in TweetRecord._fields})
+    if isinstance(record.datetime, str):
+        record = record._replace(datetime=datetime.datetime.fromisoformat(record.datetime.replace('Z', '+00:00')))
+    elif hasattr(record.datetime, 'to_pydatetime'):
+        record = record._replace(datetime=record.datetime.to_pydatetime())
+    return record
+
+
+def read_dump(path):
+    """
+    Yield the TweetRecord stored in a .jsonl or .parquet dump.
+    """
+    if path.endswith('.parquet'):
+        import pandas as pd
+
+        for data in pd.read_parquet(path).to_dict('records'):
+            yield record_from_dict(data)
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield record_from_dict(json.loads(line))
+
+
+def write_jsonl(records, path):
+    """
+    Record tweets, e.g. from a live source, as a dump for ReplaySource.
+    Returns the number of records written.
+    """
+    n = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            data = record._asdict()
+            if hasattr(data['datetime'], 'isoformat'):
+                data['datetime'] = data['datetime'].isoformat()
+            f.write(json.dumps(data, ensure_ascii=False) + '\n')
+            n += 1
+    return n
+
+
+def get_source(spec=None, delay=None):
+    """
+    Build the source described by spec, by default the TWEET_SOURCE
+    environment variable.
+    """
+    if spec is None:
+        spec = os.environ.get('TWEET_SOURCE', 'snscrape')
+    if delay is None:
+        delay = float(os.environ.get('TWEET_SOURCE_DELAY', 0))
+    kind, _, arg = spec.partition(':')
+    if kind == 'snscrape':
+        return SnscrapeSource()
+    if kind == 'replay':
+        return ReplaySource(arg, delay=delay)
+    if kind == 'synthetic':
+        return SyntheticSource(int(arg or 1000), delay=delay)
+    raise ValueError(f'Unknown tweet source: {spec!r}')
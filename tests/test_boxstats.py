@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pytest
+
+import boxstats
+from boxstats import BoxStats, QuantileSketch, exact_summary, SKETCH_ACCURACY
+
+
+@pytest.fixture
+def values():
+    return np.random.default_rng(0).lognormal(6, 1.5, 20000).astype(int)
+
+
+def test_sketch_quantiles_within_accuracy(values):
+    sketch = QuantileSketch()
+    sketch.add(values)
+    exact = np.quantile(values, [0.01, 0.25, 0.5, 0.75, 0.99])
+    approx = sketch.quantiles([0.01, 0.25, 0.5, 0.75, 0.99])
+    assert np.all(np.abs(approx - exact) <= SKETCH_ACCURACY * exact + 1)
+
+
+def test_sketch_summary_close_to_exact(values):
+    sketch = QuantileSketch()
+    sketch.add(values)
+    exact = exact_summary(values)
+    approx = sketch.summary()
+    assert approx.count == exact.count
+    for field in ('q1', 'median', 'q3', 'upper'):
+        # Whiskers fall on bucket values, so twice the bucket accuracy
+        assert getattr(approx, field) == pytest.approx(getattr(exact, field), rel=2 * SKETCH_ACCURACY)
+
+
+def test_merged_and_removed_sketches_match_a_fresh_one(values):
+    merged = QuantileSketch()
+    merged.add(values[:5000])
+    other = QuantileSketch()
+    other.add(values[5000:])
+    merged.merge(other)
+    merged.remove(values[:5000])
+    fresh = QuantileSketch()
+    fresh.add(values[5000:])
+    assert merged.bins == fresh.bins and merged.zeros == fresh.zeros and merged.count == fresh.count
+
+
+def test_sketch_rejects_negative_values():
+    with pytest.raises(ValueError):
+        QuantileSketch().add([1, -1])
+
+
+def test_empty_summaries():
+    assert exact_summary([]).count == 0
+    assert QuantileSketch().summary().count == 0
+    assert BoxStats().summary('missing').count == 0
+
+
+def test_small_groups_are_exact(values):
+    stats = BoxStats()
+    ids = np.arange(500)
+    assert stats.sync('k', ids, values[:500]) == exact_summary(values[:500])
+
+
+def test_incremental_sync_matches_a_fresh_sketch(values):
+    stats = BoxStats(exact_max_values=100)
+    ids = np.random.default_rng(1).permutation(10 ** 6)[:len(values)]
+    for start, end in [(0, 6000), (1000, 8000), (3000, 9000)]:
+        changed = values.copy()
+        changed[start:start + 50] += 7
+        summary = stats.sync('k', ids[start:end], changed[start:end])
+        fresh = QuantileSketch()
+        fresh.add(changed[start:end])
+        assert summary == fresh.summary()
+
+
+def test_keys_are_independent_and_bounded(values):
+    stats = BoxStats(max_keys=2)
+    stats.sync((1000, 'a'), np.arange(100), values[:100])
+    stats.sync((2000, 'a'), np.arange(200), values[:200])
+    assert stats.summary((1000, 'a')).count == 100
+    assert stats.summary((2000, 'a')).count == 200
+    stats.sync((3000, 'a'), np.arange(300), values[:300])
+    assert list(stats.keys) == [(2000, 'a'), (3000, 'a')]
+
+
+def test_concurrent_syncs_return_their_own_summaries(values):
+    stats = BoxStats(exact_max_values=1000)
+    expected = {}
+    for n in (800, 3000):
+        sketch = QuantileSketch()
+        sketch.add(values[:n])
+        expected[n] = exact_summary(values[:n]) if n <= 1000 else sketch.summary()
+    wrong = []
+
+    def session(n):
+        for _ in range(50):
+            if stats.sync('shared', np.arange(n), values[:n]) != expected[n]:
+                wrong.append(n)
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in (800, 3000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not wrong
+
+
+def test_changed_items():
+    removed, added = boxstats.changed_items(np.array([1, 2, 3]), np.array([1.0, 2.0, np.nan]),
+                                            np.array([2, 3, 4]), np.array([2.5, np.nan, 4.0]))
+    assert removed.tolist() == [True, True, False]
+    assert added.tolist() == [True, False, True]
@@ -0,0 +1,106 @@
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from leia import LexiconHit
+from lexiconindex import LexiconIndex, normalize_term
+
+TERMS = [('odio', -3.2), ('ruim', -2.5), ('triste', -1.9), ('bom', 1.9), ('feliz', 2.4), ('amor', 3.2)]
+
+
+@pytest.fixture
+def tweets():
+    # (tweet id, username, timestamp, hits) with a few hits each
+    rng = np.random.default_rng(0)
+    rows = []
+    for tweet_id in rng.permutation(10 ** 6)[:400]:
+        hits = []
+        for term in rng.integers(0, len(TERMS), rng.integers(0, 4)):
+            token, valence = TERMS[term]
+            negated = bool(rng.random() < 0.2)
+            hits.append(LexiconHit(token, -valence * 0.74 if negated else valence, negated, bool(rng.random() < 0.1)))
+        rows.append((int(tweet_id), ['a', 'b', 'c'][rng.integers(0, 3)], float(1.65e9 + rng.uniform(0, 10 ** 6)),
+                     hits))
+    return rows
+
+
+def build(tweets):
+    index = LexiconIndex()
+    index.add(*zip(*tweets))
+    return index
+
+
+def brute_top_terms(tweets, username=None, start=None, end=None, n=10, negative=True, tweet_ids=None):
+    totals, hits, with_term = defaultdict(float), defaultdict(int), defaultdict(set)
+    for tweet_id, user, timestamp, tweet_hits in tweets:
+        if ((username is not None and user != username) or (start is not None and timestamp < start)
+                or (end is not None and timestamp >= end) or (tweet_ids is not None and tweet_id not in tweet_ids)):
+            continue
+        for hit in tweet_hits:
+            if (hit.valence < 0) if negative else (hit.valence > 0):
+                totals[hit.token] += hit.valence
+                hits[hit.token] += 1
+                with_term[hit.token].add(tweet_id)
+    order = sorted(totals, key=lambda term: totals[term] if negative else -totals[term])
+    return [(term, totals[term], hits[term], len(with_term[term])) for term in order[:n]]
+
+
+def assert_terms_equal(result, expected):
+    assert [row[0] for row in result] == [row[0] for row in expected]
+    for row, expected_row in zip(result, expected):
+        assert row[1] == pytest.approx(expected_row[1], rel=1e-5)
+        assert row[2:] == expected_row[2:]
+
+
+def test_add_skips_indexed_tweets(tweets):
+    index = LexiconIndex()
+    assert index.add(*zip(*tweets[:300])) == 300
+    hits = len(index.hit_tweets)
+    assert index.add(*zip(*tweets)) == 100
+    assert index.add(*zip(*tweets)) == 0
+    assert len(index) == len(tweets)
+    assert len(index.hit_tweets) == sum(len(row[3]) for row in tweets)
+    assert len(index.hit_tweets) > hits
+    assert_terms_equal(index.top_terms(), brute_top_terms(tweets))
+
+
+@pytest.mark.parametrize('negative', [True, False])
+def test_top_terms_filters(tweets, negative):
+    index = build(tweets)
+    start, end = 1.65e9 + 2e5, 1.65e9 + 7e5
+    ids = {row[0] for row in tweets[::3]}
+    for username, start, end, tweet_ids in [(None, None, None, None), ('a', None, None, None),
+                                            ('b', start, end, None), (None, start, None, None),
+                                            ('c', None, end, ids), ('nobody', None, None, None)]:
+        expected = brute_top_terms(tweets, username, start, end, 3, negative, tweet_ids)
+        result = index.top_terms(username, start, end, 3, negative, None if tweet_ids is None else list(tweet_ids))
+        assert_terms_equal(result, expected)
+
+
+def test_tweets_with(tweets):
+    index = build(tweets)
+    ids = {row[0] for row in tweets[::2]}
+    expected = sorted(((timestamp, tweet_id, hit.valence, hit.negated, hit.boosted)
+                       for tweet_id, user, timestamp, tweet_hits in tweets if user == 'a' and tweet_id in ids
+                       for hit in tweet_hits if hit.token == 'triste'), reverse=True)
+    expected = [row[1:] for row in expected]
+    result = index.tweets_with(' Triste ', 'a', tweet_ids=list(ids))
+    assert [row[0] for row in result] == [row[0] for row in expected]
+    assert [row[2:] for row in result] == [row[2:] for row in expected]
+    assert np.allclose([row[1] for row in result], [row[1] for row in expected])
+    assert index.tweets_with('inexistente') == []
+
+
+def test_columns_round_trip(tweets):
+    index = build(tweets)
+    copy = LexiconIndex()
+    # Tweets without hits have no rows, so they are not stored
+    assert copy.add_columns(index.columns()) == sum(1 for row in tweets if row[3])
+    assert copy.add_columns(index.columns()) == 0
+    assert_terms_equal(copy.top_terms(n=len(TERMS)), index.top_terms(n=len(TERMS)))
+    assert copy.tweets_with('amor') == index.tweets_with('amor')
+
+
+def test_normalize_term():
+    assert normalize_term(' Ódio ') == 'odio'
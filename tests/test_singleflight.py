@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import leia
+import pipeline
+from pipeline import SingleFlight
+
+
+class Rerun(BaseException):
+    # Stands in for Streamlit's RerunException and StopException
+    pass
+
+
+def run_together(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'tweets'
+
+    run_together([lambda: results.append(flight.do('perfil', load)) for _ in range(10)])
+    assert len(calls) == 1
+    assert sorted(results) == [('tweets', False)] + [('tweets', True)] * 9
+    assert not flight.flights
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('a', lambda: 2) == (2, False)
+    assert flight.do('b', lambda: 3) == (3, False)
+
+
+def test_exceptions_are_shared_with_waiting_callers():
+    flight = SingleFlight()
+    calls = []
+    errors = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.2)
+        raise ValueError('scrape failed')
+
+    def call():
+        try:
+            flight.do('perfil', load)
+        except ValueError as error:
+            errors.append(error)
+
+    run_together([call] * 5)
+    assert len(calls) == 1
+    assert len(errors) == 5
+    assert not flight.flights
+
+
+def test_control_flow_exceptions_let_a_waiting_caller_run_instead():
+    flight = SingleFlight()
+    leaders = []
+    outcomes = []
+
+    def load(caller):
+        leaders.append(caller)
+        time.sleep(0.2)
+        if caller == 0:
+            raise Rerun()
+        return caller
+
+    def call(caller):
+        try:
+            outcomes.append(flight.do('perfil', load, caller))
+        except Rerun:
+            outcomes.append('rerun')
+
+    first = threading.Thread(target=call, args=(0,))
+    first.start()
+    time.sleep(0.05)
+    run_together([lambda caller=caller: call(caller) for caller in (1, 2, 3)])
+    first.join()
+    assert leaders[0] == 0 and len(leaders) == 2
+    second = leaders[1]
+    assert outcomes.count('rerun') == 1
+    assert sorted(outcome for outcome in outcomes if outcome != 'rerun') == \
+        sorted([(second, False)] + [(second, True)] * 2)
+    assert not flight.flights
+
+
+@pytest.fixture
+def fresh_sentiment():
+    for resource in (pipeline.sentimentCache, pipeline.lexiconIndex):
+        resource.clear()
+    yield
+    for resource in (pipeline.sentimentCache, pipeline.lexiconIndex):
+        resource.clear()
+
+
+def test_sessions_score_the_same_new_tweets_once(fresh_sentiment, monkeypatch):
+    scored = []
+    batch = leia.SentimentIntensityAnalyzer.polarity_scores_batch
+
+    def counting(self, texts, hits=None):
+        scored.extend(texts)
+        time.sleep(0.1)
+        return batch(self, texts, hits)
+
+    monkeypatch.setattr(leia.SentimentIntensityAnalyzer, 'polarity_scores_batch', counting)
+    tweets = pd.DataFrame({'Tweet Id': range(100), 'Username': ['perfil'] * 100,
+                           'Datetime': pd.date_range('2022-10-01', periods=100, freq='h', tz='UTC'),
+                           'Text': [f'muito bom {i}' for i in range(100)]})
+    frames = []
+    run_together([lambda i=i: frames.append(pipeline.addSentimentColumns(tweets.iloc[i * 10:])) for i in range(5)])
+    assert len(scored) == 100
+    assert all((frame['compound'] > 0).all() for frame in frames)
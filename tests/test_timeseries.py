@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from timeseries import RollingSeries, DAY_SECONDS, ROLLING_DAYS, EWM_HALFLIFE_DAYS
+
+
+@pytest.fixture
+def tweets():
+    rng = np.random.default_rng(0)
+    n = 600
+    # About two months, with some empty days
+    timestamps = 1.65e9 + np.sort(rng.uniform(0, 60 * DAY_SECONDS, n))
+    timestamps = timestamps[(timestamps // DAY_SECONDS) % 9 != 4]
+    n = len(timestamps)
+    return pd.DataFrame({'id': rng.permutation(10 ** 6)[:n], 'timestamp': timestamps,
+                         'engagement': rng.lognormal(0, 1, n), 'compound': rng.uniform(-1, 1, n)})
+
+
+def sync(series, tweets, key='perfil'):
+    return series.sync(key, tweets['id'], tweets['timestamp'], tweets['engagement'], tweets['compound'])
+
+
+def reference(tweets):
+    # Per day: tweets, mean engagement over the last ROLLING_DAYS days and the
+    # time-weighted EWM of compound as of the day's last tweet
+    tweets = tweets.sort_values('timestamp')
+    days = (tweets['timestamp'] // DAY_SECONDS).astype(int)
+    times = pd.to_datetime(tweets['timestamp'], unit='s')
+    ewm = tweets['compound'].ewm(halflife=pd.Timedelta(days=EWM_HALFLIFE_DAYS), times=times).mean()
+    index = pd.RangeIndex(days.min(), days.max() + 1)
+    counts = days.value_counts().reindex(index, fill_value=0)
+    engagement = tweets.groupby(days)['engagement'].sum().reindex(index, fill_value=0.0)
+    window_counts = counts.rolling(ROLLING_DAYS, min_periods=1).sum()
+    window_engagement = engagement.rolling(ROLLING_DAYS, min_periods=1).sum()
+    return pd.DataFrame({'tweets': counts,
+                         'engagement_ratio_7d': (window_engagement / window_counts).where(window_counts > 0),
+                         'compound_ewm': ewm.groupby(days.to_numpy()).last().reindex(index).ffill()})
+
+
+def frame(points):
+    return pd.DataFrame(points).set_index('day')
+
+
+def assert_series_equal(points, expected):
+    got = frame(points)
+    assert got.index.tolist() == expected.index.tolist()
+    assert got['tweets'].tolist() == expected['tweets'].tolist()
+    for column in ('engagement_ratio_7d', 'compound_ewm'):
+        np.testing.assert_allclose(got[column], expected[column], rtol=1e-9)
+
+
+def test_matches_a_pandas_reference(tweets):
+    points = sync(RollingSeries(), tweets)
+    assert_series_equal(points, reference(tweets))
+    assert frame(points)['tweets_per_hour'].tolist() == (reference(tweets)['tweets'] / 24).tolist()
+
+
+def test_incremental_syncs_match_a_fresh_series(tweets):
+    series = RollingSeries()
+    shuffled = tweets.sample(frac=1, random_state=1)
+    for end in range(100, len(shuffled) + 100, 100):
+        sync(series, shuffled.iloc[:end])
+    # Refreshed counts, then tweets dropped from the start and the end
+    changed = tweets.copy()
+    changed.loc[changed.index[::7], 'engagement'] *= 3
+    for current in (changed, changed.iloc[40:], changed.iloc[40:-30]):
+        assert_series_equal(sync(series, current), reference(current))
+
+
+def test_streamed_tweets_only_extend_the_series(tweets):
+    series = RollingSeries()
+    before = sync(series, tweets.iloc[:-20])
+    after = sync(series, tweets)
+    kept = len(frame(before).loc[:tweets['timestamp'].iloc[-21] // DAY_SECONDS - 1])
+    assert after[:kept] == before[:kept]
+    assert_series_equal(after, reference(tweets))
+
+
+def test_unchanged_sync_returns_the_same_series(tweets):
+    series = RollingSeries()
+    assert sync(series, tweets) == sync(series, tweets) == series.series('perfil')
+
+
+def test_without_compounds_the_ewm_is_nan(tweets):
+    points = RollingSeries().sync('perfil', tweets['id'], tweets['timestamp'], tweets['engagement'])
+    assert all(math.isnan(point.compound_ewm) for point in points)
+
+
+def test_keys_are_independent_and_bounded(tweets):
+    series = RollingSeries(max_keys=2)
+    sync(series, tweets.iloc[:100], (1000, 'perfil'))
+    sync(series, tweets, (2000, 'perfil'))
+    assert sum(point.tweets for point in series.series((1000, 'perfil'))) == 100
+    sync(series, tweets, (3000, 'perfil'))
+    assert series.series((1000, 'perfil')) == []
+    assert list(series.keys) == [(2000, 'perfil'), (3000, 'perfil')]
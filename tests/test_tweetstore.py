@@ -0,0 +1,95 @@
+import datetime
+
+import pytest
+
+from tweetstore import TweetStore
+
+
+def row(tweet_id, likes=0):
+    return ('perfil', 'Perfil', '', 100, 10, datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc),
+            tweet_id, f'tweet {tweet_id}', likes, 0, 0)
+
+
+def rows(newest, oldest, likes=0):
+    # Newest first, as a scrape yields them
+    return [row(tweet_id, likes) for tweet_id in range(newest, oldest - 1, -1)]
+
+
+def cancelled(items, after):
+    # Stops like a live scrape whose cancel event was set
+    for i, item in enumerate(items):
+        if i == after:
+            return
+        yield item
+
+
+def failing(items, after):
+    for i, item in enumerate(items):
+        if i == after:
+            raise RuntimeError('scrape failed')
+        yield item
+
+
+@pytest.fixture
+def store():
+    store = TweetStore(':memory:')
+    store.sync('perfil', rows(100, 1), 100)
+    return store
+
+
+def test_first_sync_stores_the_run():
+    store = TweetStore(':memory:')
+    assert store.sync('@Perfil', rows(100, 1), 50) == 50
+    assert store.span('perfil') == (100, 51)
+    assert [r[6] for r in store.latest('perfil', 3)] == [100, 99, 98]
+
+
+def test_new_tweets_join_the_stored_run(store):
+    store.sync('perfil', rows(110, 1), 100, backfill=5)
+    assert store.span('perfil') == (110, 1)
+    assert store.count('perfil') == 110
+
+
+def test_backfill_refreshes_the_newest_stored_counts(store):
+    read = store.sync('perfil', rows(105, 1, likes=7), 100, backfill=5)
+    assert read == 10
+    likes = {r[6]: r[8] for r in store.latest('perfil', 110)}
+    assert likes[100] == likes[96] == 7
+    assert likes[95] == 0
+
+
+def test_older_reads_only_the_missing_tweets(store):
+    requested = []
+
+    def older(max_id):
+        requested.append(max_id)
+        return iter(rows(max_id, -500))
+
+    store.sync('perfil', rows(100, 1), 150, backfill=5, older=older)
+    assert requested == [0]
+    assert store.span('perfil') == (100, -49)
+    assert store.count('perfil') == 150
+
+
+def test_cancelled_scrape_keeps_the_stored_run(store):
+    assert store.sync('perfil', cancelled(rows(200, 1), 10), 150) == 10
+    assert store.span('perfil') == (100, 1)
+    assert [r[6] for r in store.latest('perfil', 1)] == [100]
+
+    # Once a scrape reaches the run, the gap rows are part of it
+    store.sync('perfil', rows(200, 1), 150, backfill=5)
+    assert store.span('perfil') == (200, 1)
+    assert store.count('perfil') == 200
+
+
+def test_failed_scrape_stores_its_rows_without_moving_the_run(store):
+    with pytest.raises(RuntimeError):
+        store.sync('perfil', failing(rows(200, 1), 10), 150)
+    assert store.span('perfil') == (100, 1)
+    assert store.count('perfil') == 100
+
+
+def test_complete_scrape_replaces_a_run_it_does_not_reach(store):
+    store.sync('perfil', rows(300, 1), 50)
+    assert store.span('perfil') == (300, 251)
+    assert store.count('perfil') == 50
@@ -0,0 +1,136 @@
+""" Rolling time series of tweet metrics, maintained incrementally.
+Each tweet only touches the daily bucket it falls in, so new tweets, late
+ones and refreshed like/RT/reply counts are folded into the days they fall
+in instead of regrouping the whole history, and the rolling series are
+only recomputed from the earliest day that changed, one step per day.
+"""
+
+import math
+import threading
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from boxstats import changed_items
+
+DAY_SECONDS = 24 * 60 * 60
+# Days averaged by the rolling engagement mean
+ROLLING_DAYS = 7
+# Half-life of the exponentially weighted mean of the compound sentiment
+EWM_HALFLIFE_DAYS = 3.0
+# Keys kept by RollingSeries, least recently synced dropped first
+MAX_KEYS = 64
+
+RollingPoint = namedtuple('RollingPoint', ['day', 'tweets', 'tweets_per_hour', 'engagement_ratio_7d',
+                                           'compound_ewm'])
+
+
+class RollingSeries(object):
+    """
+    Per key, e.g. (dataset, username), daily buckets of the tweets' count,
+    summed engagement and exponentially weighted compound sentiment.
+    Tweets are identified by id, so syncing one with new values replaces
+    its contribution. The max_keys keys synced last are kept.
+
+    The weighted mean is continuous in time: a tweet from time t weighs
+    0.5 ** ((T - t) / halflife) at time T, so tweets of the same day are
+    weighed by their hour, whatever order they arrive in.
+    """
+    def __init__(self, window_days=ROLLING_DAYS, halflife_days=EWM_HALFLIFE_DAYS, max_keys=MAX_KEYS):
+        self.window_days = window_days
+        self.tau = halflife_days * DAY_SECONDS / math.log(2)
+        self.max_keys = max_keys
+        # key -> [sorted ids, their (timestamp, engagement, compound) rows,
+        # buckets by day, series points, EWM (weighted, weight) after each point]
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _apply(self, buckets, rows, sign):
+        # Add (or with sign -1 take away) the contributions of rows to the
+        # buckets of their days, weighted as seen from the end of each day.
+        # Returns the earliest day touched, or None
+        if not len(rows):
+            return None
+        timestamps, engagements, compounds = rows.T
+        days = np.floor(timestamps / DAY_SECONDS).astype(np.int64)
+        scored = ~np.isnan(compounds)
+        weights = np.where(scored, np.exp((timestamps - (days + 1) * DAY_SECONDS) / self.tau), 0.0)
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        sums = [np.bincount(inverse, minlength=len(unique_days)),
+                np.bincount(inverse, engagements, len(unique_days)),
+                np.bincount(inverse, np.where(scored, compounds, 0.0) * weights, len(unique_days)),
+                np.bincount(inverse, weights, len(unique_days))]
+        for day, count, engagement, weighted, weight in zip(unique_days.tolist(), *(s.tolist() for s in sums)):
+            bucket = buckets.setdefault(day, [0, 0.0, 0.0, 0.0])
+            bucket[0] += sign * count
+            bucket[1] += sign * engagement
+            bucket[2] += sign * weighted
+            bucket[3] += sign * weight
+            if not bucket[0]:
+                # Also drops the rounding left over by the subtractions
+                del buckets[day]
+        return int(unique_days[0])
+
+    def sync(self, key, ids, timestamps, engagements, compounds=None):
+        """
+        Make key hold exactly the given tweets, timestamps in seconds since
+        the epoch (UTC), and return its series(). The tweets are diffed
+        against the ones held with numpy; only the new, changed or missing
+        ones touch the buckets, and the series is only recomputed from the
+        earliest day they fall in.
+        """
+        if compounds is None:
+            compounds = np.full(len(ids), np.nan)
+        ids, first = np.unique(np.asarray(ids, dtype=np.int64), return_index=True)
+        rows = np.column_stack([np.asarray(column, dtype=np.float64)
+                                for column in (timestamps, engagements, compounds)])[first]
+        with self.lock:
+            state = self.keys.pop(key, None) or [ids[:0], rows[:0], {}, [], []]
+            removed, added = changed_items(state[0], state[1], ids, rows)
+            touched = [day for day in (self._apply(state[2], state[1][removed], -1),
+                                       self._apply(state[2], rows[added], 1)) if day is not None]
+            state[0], state[1] = ids, rows
+            if touched:
+                self._update_series(state, min(touched))
+            self.keys[key] = state
+            while len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+            return list(state[3])
+
+    def series(self, key):
+        """
+        Return a RollingPoint for every day from the key's first tweet to
+        its last one, empty days included.
+        """
+        with self.lock:
+            return list(self.keys[key][3]) if key in self.keys else []
+
+    def _update_series(self, state, since):
+        # Recompute the points from day `since` on, keeping the earlier ones
+        # unless the first day moved, which changes every weighted mean
+        buckets, points, ewm = state[2], state[3], state[4]
+        if not buckets:
+            del points[:], ewm[:]
+            return
+        first = min(buckets)
+        if points and points[0].day == first and since > first:
+            keep = min(since, points[-1].day + 1) - first
+            del points[keep:], ewm[keep:]
+            weighted, weight = ewm[-1]
+        else:
+            del points[:], ewm[:]
+            weighted = weight = 0.0
+        decay = math.exp(-DAY_SECONDS / self.tau)
+        empty = (0, 0.0, 0.0, 0.0)
+        for day in range(first + len(points), max(buckets) + 1):
+            count, _, day_weighted, day_weight = buckets.get(day, empty)
+            # Sums over the last window_days days
+            window = [buckets.get(past, empty) for past in range(day - self.window_days + 1, day + 1)]
+            tweets = sum(bucket[0] for bucket in window)
+            engagement = sum(bucket[1] for bucket in window)
+            weighted = weighted * decay + day_weighted
+            weight = weight * decay + day_weight
+            points.append(RollingPoint(day, count, count / 24,
+                                       engagement / tweets if tweets else math.nan,
+                                       weighted / weight if weight > 0 else math.nan))
+            ewm.append((weighted, weight))
@@ -0,0 +1,218 @@
+""" Local SQLite store of scraped tweets, keyed by profile and Tweet Id.
+Rows go in and come out in the dashboard's column order: Username,
+Displayname, Description, Follower Count, Following Count, Datetime,
+Tweet Id, Text, Likes, Retweets, Replies.
+"""
+
+import os
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+TWEET_STORE_PATH = os.environ.get('TWEET_STORE_PATH',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tweets.sqlite'))
+# Number of already stored tweets re-read on each sync to refresh their counts
+BACKFILL_TWEETS = 20
+
+STORE_COLUMNS = ('username', 'displayname', 'description', 'follower_count', 'following_count',
+                 'datetime', 'tweet_id', 'text', 'likes', 'retweets', 'replies')
+TWEET_ID = STORE_COLUMNS.index('tweet_id')
+DATETIME = STORE_COLUMNS.index('datetime')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tweets (
+    profile TEXT NOT NULL,
+    username TEXT,
+    displayname TEXT,
+    description TEXT,
+    follower_count INTEGER,
+    following_count INTEGER,
+    datetime TEXT,
+    tweet_id INTEGER NOT NULL,
+    text TEXT,
+    likes INTEGER,
+    retweets INTEGER,
+    replies INTEGER,
+    fetched_at REAL,
+    PRIMARY KEY (profile, tweet_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS profiles (
+    profile TEXT PRIMARY KEY,
+    newest_id INTEGER,
+    oldest_id INTEGER,
+    synced_at REAL
+);
+"""
+
+INSERT = """
+INSERT INTO tweets (profile, {columns}, fetched_at) VALUES (?, {marks}, ?)
+ON CONFLICT (profile, tweet_id) DO UPDATE SET {updates}, fetched_at = excluded.fetched_at
+""".format(columns=', '.join(STORE_COLUMNS),
+           marks=', '.join('?' * len(STORE_COLUMNS)),
+           updates=', '.join(f'{column} = excluded.{column}' for column in STORE_COLUMNS if column != 'tweet_id'))
+
+
+def profile_key(username):
+    return username.strip().lstrip('@').lower()
+
+
+class TweetStore(object):
+    """
+    Tweets are kept per profile together with the id range [oldest_id,
+    newest_id] known to hold every tweet of the profile in between, so
+    reads never skip over tweets that were not scraped yet.
+    """
+    def __init__(self, path=TWEET_STORE_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        else:
+            # A single shared connection, otherwise every connect() would
+            # see a fresh empty database; threads take turns using it
+            self._memory = sqlite3.connect(path, check_same_thread=False)
+            self._memory_lock = threading.Lock()
+        with closing(self.connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        if self.path == ':memory:':
+            return _SharedConnection(self._memory, self._memory_lock)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def span(self, username):
+        """
+        Return (newest_id, oldest_id) of the stored run of tweets, or None.
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute('SELECT newest_id, oldest_id FROM profiles WHERE profile = ?',
+                               (profile_key(username),)).fetchone()
+        return row
+
+    def last_id(self, username):
+        span = self.span(username)
+        return span[0] if span else None
+
+    def count(self, username):
+        span = self.span(username)
+        if span is None:
+            return 0
+        with closing(self.connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM tweets WHERE profile = ? AND tweet_id BETWEEN ? AND ?',
+                                (profile_key(username), span[1], span[0])).fetchone()[0]
+
+    def latest(self, username, n_tweets):
+        """
+        Return the n_tweets newest stored tweets of a profile, newest first.
+        """
+        span = self.span(username)
+        if span is None:
+            return []
+        with closing(self.connect()) as conn:
+            return conn.execute(f'SELECT {", ".join(STORE_COLUMNS)} FROM tweets '
+                                'WHERE profile = ? AND tweet_id BETWEEN ? AND ? '
+                                'ORDER BY tweet_id DESC LIMIT ?',
+                                (profile_key(username), span[1], span[0], n_tweets)).fetchall()
+
+    def sync(self, username, items, n_tweets, backfill=BACKFILL_TWEETS, older=None):
+        """
+        Store tweets from `items`, an iterable of rows newest first such as a
+        live scrape, and return how many were read.
+
+        Reading stops once it reaches the stored run, has re-read `backfill`
+        stored tweets to refresh their like/RT/reply counts and the store
+        covers the n_tweets newest tweets; otherwise after n_tweets items,
+        which then replace a stored run they do not reach. Items that end
+        (or fail) before either only fill in the gap above the run.
+        If the stored run is too short, older(max_id) is called, when given,
+        for the rows with ids up to max_id, to read just the missing ones
+        from below the run instead of going through the stored ones.
+        """
+        key = profile_key(username)
+        span = self.span(username)
+        run_count = self.count(username) if span else 0
+        rows = []
+        n_old = 0
+        complete = False
+        try:
+            for row in items:
+                row = tuple(row)
+                rows.append(row)
+                if span is not None and row[TWEET_ID] <= span[0]:
+                    n_old += 1
+                    if n_old >= backfill:
+                        missing = n_tweets - (len(rows) + run_count - n_old)
+                        if missing > 0 and older is not None:
+                            older_items = older(span[1] - 1)
+                            try:
+                                rows.extend(tuple(row) for row in itertools.islice(older_items, missing))
+                            finally:
+                                if hasattr(older_items, 'close'):
+                                    older_items.close()
+                        if missing <= 0 or older is not None:
+                            break
+                if len(rows) >= n_tweets:
+                    complete = True
+                    break
+        except BaseException:
+            # What was read before a scrape error is kept all the same
+            self._store(key, span, rows, n_old, False)
+            raise
+        return self._store(key, span, rows, n_old, complete)
+
+    def _store(self, key, span, rows, n_old, complete):
+        if not rows:
+            return 0
+        ids = [row[TWEET_ID] for row in rows]
+        newest, oldest = max(ids), min(ids)
+        if span is not None and n_old:
+            # The scrape reached the stored run, so the two join up
+            newest, oldest = max(newest, span[0]), min(oldest, span[1])
+        elif span is not None and not complete:
+            # A scrape cancelled or failed before reaching the stored run
+            # leaves a gap under its rows: they are stored, but the run
+            # stays as it was until a later scrape connects them
+            newest = None
+
+        now = time.time()
+        with closing(self.connect()) as conn, conn:
+            conn.executemany(INSERT, ((key,) + _storable(row) + (now,) for row in rows))
+            if newest is not None:
+                conn.execute('INSERT INTO profiles (profile, newest_id, oldest_id, synced_at) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT (profile) DO UPDATE SET newest_id = excluded.newest_id, '
+                             'oldest_id = excluded.oldest_id, synced_at = excluded.synced_at',
+                             (key, newest, oldest, now))
+        return len(rows)
+
+
+def _storable(row):
+    value = row[DATETIME]
+    if hasattr(value, 'isoformat'):
+        row = row[:DATETIME] + (value.isoformat(),) + row[DATETIME + 1:]
+    return row
+
+
+class _SharedConnection(object):
+    # Lets the shared in-memory connection be used like a per-call one,
+    # holding its lock from connect() until close()
+    def __init__(self, conn, lock):
+        lock.acquire()
+        self._conn = conn
+        self._lock = lock
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None